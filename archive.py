@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+""" Replay archive: many games' replays in one block compressed file
+
+The file starts with FILE_HEADER and each game is appended as:
+
+    header block   the game result with its per-turn replay data taken out
+    turn blocks    block_turns turns each, the replay's per-turn records
+    directory      JSON: game_id, revision, turns, block_turns and the
+                   [offset, length] of the header and turn blocks
+    trailer        TRAILER: MAGIC, directory offset and length, and the
+                   offset of the game before's trailer, 0 for the first
+
+Blocks are zlib compressed JSON, directories and trailers are not. The
+per-turn records are the revision 1 state changes, or for revision 2
+the ReplayRecorder entries with blocks starting at keyframes, so any
+turn can be read by decompressing its one block. Appends never rewrite
+what's already there, and an append cut short is dropped by the next
+ArchiveWriter, since the archive only goes as far as its last whole
+trailer.
+
+ReplayArchive maps the file and reads the trailer chain back from the
+end for its index, so opening doesn't decompress anything.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import board
+import replay
+
+FILE_HEADER = b'GOREPLAY'
+MAGIC = b'GOGAME\r\n'
+# magic, directory offset, directory length, previous trailer offset
+TRAILER = struct.Struct('<8sQQQ')
+BLOCK_TURNS = 50
+COMPRESS_LEVEL = 6
+
+_CSV_CELLS = dict((value, cell) for (cell, value) in board.CSV_VALUES.items())
+
+def _pack(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'), COMPRESS_LEVEL)
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def _read_trailer(data, offset):
+    """ (directory offset, directory length, previous) of the trailer at offset, or None """
+    if offset < len(FILE_HEADER) or offset + TRAILER.size > len(data):
+        return None
+    (magic, directory, length, previous) = TRAILER.unpack_from(data, offset)
+    if magic != MAGIC or directory + length != offset or previous >= offset:
+        return None
+    return (directory, length, previous)
+
+def _last_trailer(data):
+    """ Offset of the last whole trailer in data, 0 if there isn't one
+
+    Normally that's the end of the file, but after an append was cut
+    short the half written game is skipped.
+    """
+    end = len(data)
+    while end > len(FILE_HEADER):
+        offset = data.rfind(MAGIC, len(FILE_HEADER), end)
+        if offset < 0:
+            break
+        if _read_trailer(data, offset) is not None:
+            return offset
+        end = offset + len(MAGIC) - 1
+    return 0
+
+def split_replay(result, block_turns=BLOCK_TURNS):
+    """ (header, turn records, block_turns) for a game result from the engine """
+    header = dict(result)
+    records = []
+    replaydata = result.get('replaydata')
+    if replaydata:
+        replaydata = dict(replaydata)
+        if replaydata.get('revision') == replay.REVISION:
+            records = list(replay.entries(replaydata))
+            for key in ('moves', 'ko', 'keyframes'):
+                replaydata[key] = []
+            # every block has to start at a keyframe
+            block_turns = replaydata['keyframe_turns']
+        else:
+            records = replaydata.get('data', [])
+            replaydata['data'] = []
+        header['replaydata'] = replaydata
+    return (header, records, block_turns)
+
+
+class ArchiveWriter:
+    """ Appends game results to a replay archive, creating it if needed """
+
+    def __init__(self, path, block_turns=BLOCK_TURNS):
+        self.block_turns = block_turns
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self.file = open(path, 'w+b')
+            self.file.write(FILE_HEADER)
+            self.last = 0
+        else:
+            self.file = open(path, 'r+b')
+            if self.file.read(len(FILE_HEADER)) != FILE_HEADER:
+                self.file.close()
+                raise ValueError("{0} isn't a replay archive".format(path))
+            data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.last = _last_trailer(data)
+            finally:
+                data.close()
+            # drop anything after the last whole game
+            self.file.truncate(self.last + TRAILER.size if self.last else len(FILE_HEADER))
+        self.file.seek(0, os.SEEK_END)
+
+    def _write(self, data):
+        offset = self.file.tell()
+        self.file.write(data)
+        return [offset, len(data)]
+
+    def append(self, game_id, result):
+        """ Add a game result, a replay file's JSON, under game_id
+
+        Returns the offset of the game's trailer in the archive.
+        """
+        (header, records, block_turns) = split_replay(result, self.block_turns)
+        directory = {
+            'game_id': game_id,
+            'revision': header.get('replaydata', {}).get('revision'),
+            'turns': len(records),
+            'block_turns': block_turns,
+            'header': self._write(_pack(header)),
+            'blocks': [self._write(_pack(records[start:start + block_turns]))
+                       for start in range(0, len(records), block_turns)],
+        }
+        (offset, length) = self._write(json.dumps(directory, separators=(',', ':')).encode('utf-8'))
+        trailer = self.file.tell()
+        self.file.write(TRAILER.pack(MAGIC, offset, length, self.last))
+        self.file.flush()
+        self.last = trailer
+        return trailer
+
+    def close(self):
+        self.file.close()
+
+# End of ArchiveWriter class
+
+class ReplayArchive:
+    """ Random access to the games and turns of a replay archive
+
+    Game ids are kept as they were appended, so look games up with the
+    same type. Every game appended stays in the index: each is known by
+    its trailer offset, as ArchiveWriter.append returns, and an id
+    appended more than once, say by two playgame runs into the same
+    archive, has to be read at one of the offsets games() lists.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if self.file.read(len(FILE_HEADER)) != FILE_HEADER:
+            self.file.close()
+            raise ValueError("{0} isn't a replay archive".format(path))
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # directories by trailer offset, the offsets by game id
+        self.directories = {}
+        self.offsets_by_id = {}
+        self.order = []
+        trailer = _last_trailer(self.data)
+        while trailer:
+            this = trailer
+            (offset, length, trailer) = _read_trailer(self.data, trailer)
+            directory = json.loads(self.data[offset:offset + length].decode('utf-8'))
+            self.directories[this] = directory
+            self.offsets_by_id.setdefault(self._key(directory['game_id']), []).insert(0, this)
+            self.order.append(this)
+        self.order.reverse()
+
+    def _key(self, game_id):
+        return json.dumps(game_id)
+
+    def _directory(self, game_id, offset=None):
+        if offset is None:
+            offsets = self.games(game_id)
+            if len(offsets) > 1:
+                raise ValueError("game {0!r} was appended {1} times, at offsets {2}; give the offset"
+                                 .format(game_id, len(offsets), offsets))
+            offset = offsets[0]
+        directory = self.directories.get(offset)
+        if directory is None or (game_id is not None and
+                                 self._key(directory['game_id']) != self._key(game_id)):
+            raise KeyError("game {0!r} isn't in the archive at offset {1}".format(game_id, offset))
+        return directory
+
+    def _block(self, location):
+        (offset, length) = location
+        return _unpack(self.data[offset:offset + length])
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, game_id):
+        return self._key(game_id) in self.offsets_by_id
+
+    def game_ids(self):
+        """ Game ids in the order they were appended, once for each time """
+        return [self.directories[offset]['game_id'] for offset in self.order]
+
+    def offsets(self):
+        """ Trailer offsets of every game in the order they were appended """
+        return list(self.order)
+
+    def games(self, game_id):
+        """ Trailer offsets of the games appended under game_id, oldest first """
+        try:
+            return list(self.offsets_by_id[self._key(game_id)])
+        except KeyError:
+            raise KeyError("game {0!r} isn't in the archive".format(game_id))
+
+    # the rest take a game id, and the game's offset when the id isn't
+    # unique; with an offset the id may be None
+
+    def turns(self, game_id, offset=None):
+        return self._directory(game_id, offset)['turns']
+
+    def header(self, game_id, offset=None):
+        """ The game result with empty per-turn replay data """
+        return self._block(self._directory(game_id, offset)['header'])
+
+    def _records(self, directory, block):
+        return self._block(directory['blocks'][block])
+
+    def turn(self, game_id, turn, offset=None):
+        """ The replay record of one turn: state changes, or a revision 2 entry """
+        directory = self._directory(game_id, offset)
+        if not 0 <= turn < directory['turns']:
+            raise IndexError("game {0!r} has {1} turns".format(directory['game_id'], directory['turns']))
+        (block, index) = divmod(turn, directory['block_turns'])
+        return self._records(directory, block)[index]
+
+    def field(self, game_id, turn, offset=None):
+        """ Cell values of the field sent after turn, ko marks included """
+        directory = self._directory(game_id, offset)
+        if directory['revision'] != replay.REVISION:
+            for change in self.turn(game_id, turn, offset):
+                if change[0] == 'update game field':
+                    return [_CSV_CELLS[value] for value in change[1].split(',')]
+            return None
+        (block, index) = divmod(turn, directory['block_turns'])
+        records = self._records(directory, block)[:index + 1]
+        replaydata = self._block(directory['header'])['replaydata']
+        # earlier turns stay empty moves, the decoder starts from the block's keyframe
+        first = turn - index
+        replaydata['moves'] = [[]] * first
+        for (step, entry) in enumerate(records):
+            replay.add_entry(replaydata, first + step, entry)
+        return replay.ReplayDecoder(replaydata).field_at(turn)
+
+    def game(self, game_id, offset=None):
+        """ The whole game result, as the engine wrote it to the replay file """
+        directory = self._directory(game_id, offset)
+        result = self._block(directory['header'])
+        replaydata = result.get('replaydata')
+        if replaydata is None:
+            return result
+        records = []
+        for block in range(0, len(directory['blocks'])):
+            records.extend(self._records(directory, block))
+        if directory['revision'] == replay.REVISION:
+            for (turn, entry) in enumerate(records):
+                replay.add_entry(replaydata, turn, entry)
+        else:
+            replaydata['data'] = records
+        return result
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+# End of ReplayArchive class
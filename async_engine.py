@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+""" Many games in one process: engine.play_game driven by asyncio
+
+run_game here is a coroutine taking the same game, botcmds and options
+as engine.run_game and returning the same game result. The game loop is
+engine.play_game itself; only the bots differ. Each one is an
+asyncio.create_subprocess_exec child read through its streams, with no
+threads of its own, and get_moves waits on every moving bot at once up
+to the turn's deadline. Bots always run unjailed.
+
+    results = asyncio.run(run_games([(game, botcmds, options), ...], concurrency=200))
+"""
+import asyncio
+import shlex
+import signal
+import sys
+import time
+
+from engine import MOVE_LINES, play_game
+from sandbox import SandboxError
+
+# the longest line a bot may write; asyncio's default is 64k
+LINE_LIMIT = 2 ** 20
+# stderr lines kept per bot between turns, as engine.get_moves reads
+ERROR_LINES = 1000
+
+class AsyncBot:
+    """ A bot process with the parts of the sandbox interface play_game uses """
+
+    def __init__(self, process):
+        self.process = process
+        self.errors = []
+        self.stderr_task = asyncio.ensure_future(self._read_errors())
+
+    @classmethod
+    async def start(cls, working_directory, shell_command):
+        command = shlex.split(shell_command.replace('\\', '/'))
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE, cwd=working_directory, limit=LINE_LIMIT)
+        except OSError:
+            raise SandboxError('Failed to start {0}'.format(command))
+        return cls(process)
+
+    async def _read_errors(self):
+        while True:
+            try:
+                line = await self.process.stderr.readline()
+            except ValueError:
+                # longer than LINE_LIMIT; what's buffered is dropped
+                continue
+            if not line:
+                return
+            if len(self.errors) < ERROR_LINES:
+                self.errors.append(line.decode('utf-8', 'replace').rstrip('\r\n'))
+
+    async def read_line(self):
+        """ The next line of stdout, None once the bot has closed it """
+        while True:
+            try:
+                line = await self.process.stdout.readline()
+            except ValueError:
+                continue
+            if not line:
+                return None
+            return line.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def take_errors(self):
+        errors = self.errors
+        self.errors = []
+        return errors
+
+    @property
+    def is_alive(self):
+        return self.process.returncode is None
+
+    def write(self, data):
+        if not self.is_alive:
+            return False
+        try:
+            self.process.stdin.write(data.encode('utf-8'))
+        except (OSError, RuntimeError):
+            # the pipe closes when the bot dies
+            pass
+
+    def _signal(self, sig):
+        try:
+            self.process.send_signal(sig)
+        except (ProcessLookupError, OSError):
+            pass
+
+    def pause(self):
+        self._signal(signal.SIGSTOP)
+
+    def resume(self):
+        self._signal(signal.SIGCONT)
+
+    def kill(self):
+        if self.is_alive:
+            self._signal(signal.SIGKILL)
+
+    def release(self):
+        pass
+
+# End of AsyncBot class
+
+async def _collect(game, bot, moves, turn, deadline):
+    """ Read a bot's lines until its move; True if it got one, None if it died """
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        try:
+            line = await asyncio.wait_for(bot.read_line(), remaining)
+        except asyncio.TimeoutError:
+            return False
+        if line is None:
+            return None
+        line = line.strip()
+        if line.lower() != 'go':
+            moves.append(line)
+        if game.bot_input_finished(line):
+            return True
+        if len(moves) >= MOVE_LINES:
+            # as many as get_moves takes; the rest would go unread
+            return False
+
+async def get_moves(game, bots, bot_nums, bots_to_play, time_limit, timebank, fischer_time, turn):
+    """ engine.get_moves for AsyncBots, waiting on all of them at once """
+    bot_moves = [[] for b in bots]
+    error_lines = [[] for b in bots]
+    statuses = [None for b in bots]
+    time_used = [0 for b in bots]
+
+    for bot in bots:
+        if bot.is_alive:
+            bot.resume()
+    start_time = time.time()
+    deadline = start_time + time_limit
+
+    async def collect(b, bot):
+        got = await _collect(game, bot, bot_moves[b], turn, deadline)
+        time_used[b] = time.time() - start_time
+        return got
+
+    playing = [b for b in range(len(bots))
+               if game.is_alive(bot_nums[b]) and bot_nums[b] in bots_to_play]
+    outcomes = await asyncio.gather(*[collect(b, bots[b]) for b in playing])
+
+    for bot in bots:
+        if bot.is_alive:
+            bot.pause()
+
+    for (b, got) in zip(playing, outcomes):
+        if got is None:
+            # stdout closed, so it's dead or as good as
+            bots[b].kill()
+            await bots[b].process.wait()
+            error_lines[b].append('turn %4d bot %s crashed' % (turn, bot_nums[b]))
+            statuses[b] = 'crashed'
+            game.kill_player(bot_nums[b])
+        elif not got:
+            error_lines[b].append('turn %4d bot %s timed out' % (turn, bot_nums[b]))
+            statuses[b] = 'timeout'
+            time_used[b] = time_limit
+            game.kill_player(bot_nums[b])
+            bots[b].kill()
+    for (b, bot) in enumerate(bots):
+        error_lines[b].extend(bot.take_errors())
+    return bot_moves, error_lines, statuses, time_used
+
+async def run_game(game, botcmds, options):
+    """ engine.run_game as a coroutine """
+    if options.get('secure_jail', None):
+        raise SandboxError("the asyncio engine runs bots unjailed only")
+    if options.get('bot_pool', None):
+        raise SandboxError("the asyncio engine starts every bot fresh")
+    steps = play_game(game, botcmds, options)
+    bots = []
+    request = next(steps)
+    while request[0] != 'done':
+        try:
+            if request[0] == 'start':
+                reply = await AsyncBot.start(request[1], request[2])
+                bots.append(reply)
+            elif request[0] == 'stop':
+                request[1].kill()
+                request[1].release()
+                reply = None
+            elif request[0] == 'moves':
+                reply = await get_moves(*request[1:])
+            elif request[0] == 'sleep':
+                await asyncio.sleep(request[1])
+                reply = None
+        except Exception:
+            request = steps.throw(*sys.exc_info())
+        else:
+            request = steps.send(reply)
+    # play_game has killed them; reap them so none are left as zombies
+    for bot in bots:
+        bot.kill()
+        await bot.process.wait()
+        await bot.stderr_task
+    return request[1]
+
+async def run_games(games, concurrency=100):
+    """ Results of run_game for each (game, botcmds, options), concurrency at a time """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited(game, botcmds, options):
+        async with limit:
+            return await run_game(game, botcmds, options)
+
+    return await asyncio.gather(*[limited(*args) for args in games])
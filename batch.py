@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+""" Go rules for a whole batch of boards at once, vectorized with NumPy
+
+BatchBoard holds N boards of the same size as one (N, height, width)
+array and plays one move on every board per call. Placement, capture,
+liberty counting, suicide and ko checks and area scoring all work on
+the whole stack at once. The rules are the same as board.Board: a move
+is illegal if it is suicide, or if it captures and recreates one of the
+last ko_depth positions. Area scores give KOMI to PLAYER2, and Zobrist
+hashes match board.Board for the same position.
+
+This is meant for self-play data generation and mass random playouts,
+not for the engine itself, and needs NumPy installed.
+"""
+import numpy as np
+
+import board
+from board import EMPTY, PLAYER1, PLAYER2, KO_BOARDS, KOMI
+
+# off-board value used when shifting cell arrays
+OFF_BOARD = -2
+
+
+def _shifts(a, fill):
+    """ a seen from each neighbour, in board.ADJACENT order
+
+    Element [d][b, r, c] is a[b] at (r, c) + ADJACENT[d], or fill where
+    that is off the board.
+    """
+    out = np.empty((4,) + a.shape, dtype=a.dtype)
+    out[0][:, 0, :] = fill
+    out[0][:, 1:, :] = a[:, :-1, :]
+    out[1][:, :, -1] = fill
+    out[1][:, :, :-1] = a[:, :, 1:]
+    out[2][:, -1, :] = fill
+    out[2][:, :-1, :] = a[:, 1:, :]
+    out[3][:, :, 0] = fill
+    out[3][:, :, 1:] = a[:, :, :-1]
+    return out
+
+
+def _spread(seed, within):
+    """ Grow seed through the 4-connected points of within until it stops """
+    reached = seed & within
+    while True:
+        grown = reached | (within & _shifts(reached, False).any(axis=0))
+        if np.array_equal(grown, reached):
+            return reached
+        reached = grown
+
+
+class BatchBoard:
+
+    def __init__(self, count, width, height, ko_depth=KO_BOARDS):
+        self.count = count
+        self.width = width
+        self.height = height
+        self.area = width * height
+        self.cells = np.zeros((count, height, width), dtype=np.int8)
+        keys = board.zobrist_table(width, height)
+        self.zobrist = np.zeros((3, height, width), dtype=np.uint64)
+        for ((row, col), key) in keys.items():
+            self.zobrist[PLAYER1, row, col] = key[PLAYER1]
+            self.zobrist[PLAYER2, row, col] = key[PLAYER2]
+        self.hashes = np.zeros(count, dtype=np.uint64)
+        # hash history per board: a ring of ko_depth entries, or a growing
+        # array for positional superko when ko_depth is None
+        self.ko_depth = ko_depth
+        self.history = np.zeros((count, ko_depth or 64), dtype=np.uint64)
+        self.pushes = np.zeros(count, dtype=np.int64)
+
+    def _players(self, players):
+        return np.broadcast_to(np.asarray(players, dtype=np.int8), (self.count,))
+
+    def groups(self):
+        """ Label the chains on every board
+
+        Returns (labels, liberties, chain_hash): per point the chain label
+        (0 for empty points) and the liberty count of its chain, and per
+        (board * (area + 1) + label) the XOR of the chain's Zobrist keys.
+        """
+        cells = self.cells
+        stones = cells != EMPTY
+        first = np.arange(1, self.area + 1).reshape(1, self.height, self.width)
+        labels = np.where(stones, first, 0)
+        same = (_shifts(cells, OFF_BOARD) == cells) & stones
+        while True:
+            around = np.where(same, _shifts(labels, 0), self.area + 1).min(axis=0)
+            merged = np.where(stones, np.minimum(labels, around), 0)
+            if np.array_equal(merged, labels):
+                break
+            labels = merged
+        slots = self.count * (self.area + 1)
+        group = np.arange(self.count).reshape(-1, 1, 1) * (self.area + 1) + labels
+        # distinct (chain, empty neighbour) pairs give the liberty counts
+        points = first - 1
+        offsets = [-self.width, 1, self.width, -1]
+        empty_nb = _shifts(cells, OFF_BOARD) == EMPTY
+        keys = []
+        for d in range(0, 4):
+            edge = empty_nb[d] & stones
+            keys.append(group[edge] * self.area + np.broadcast_to(points, cells.shape)[edge] + offsets[d])
+        pairs = np.unique(np.concatenate(keys))
+        counts = np.bincount(pairs // self.area, minlength=slots)
+        liberties = np.where(stones, counts[group], 0)
+        chain_hash = np.zeros(slots, dtype=np.uint64)
+        stone_keys = self.zobrist[cells, np.arange(self.height).reshape(1, -1, 1),
+                                  np.arange(self.width).reshape(1, 1, -1)]
+        np.bitwise_xor.at(chain_hash, group[stones], stone_keys[stones])
+        return labels, liberties, chain_hash
+
+    def _in_history(self, boards, hashes):
+        depth = self.history.shape[1]
+        valid = np.arange(depth) < np.minimum(self.pushes[boards], depth)[:, None]
+        return ((self.history[boards] == hashes[:, None]) & valid).any(axis=1)
+
+    def legal_mask(self, players):
+        """ (N, height, width) mask of the legal moves for each board's player """
+        players = self._players(players)
+        own = players.reshape(-1, 1, 1)
+        other = PLAYER1 + PLAYER2 - own
+        labels, liberties, chain_hash = self.groups()
+        nb_cells = _shifts(self.cells, OFF_BOARD)
+        nb_libs = _shifts(liberties, 0)
+        capture = (nb_cells == other) & (nb_libs == 1)
+        legal = ((nb_cells == EMPTY) | ((nb_cells == own) & (nb_libs > 1)) | capture).any(axis=0)
+        legal &= self.cells == EMPTY
+        # only captures can repeat a position
+        (b, r, c) = np.nonzero(legal & capture.any(axis=0))
+        if len(b):
+            nb_labels = _shifts(labels, 0)
+            after = self.hashes[b] ^ self.zobrist[players[b], r, c]
+            for d in range(0, 4):
+                label = nb_labels[d, b, r, c]
+                take = capture[d, b, r, c]
+                for e in range(0, d):
+                    take &= ~(capture[e, b, r, c] & (nb_labels[e, b, r, c] == label))
+                chain = chain_hash[b * (self.area + 1) + label]
+                after ^= np.where(take, chain, np.uint64(0))
+            repeat = self._in_history(b, after)
+            legal[b[repeat], r[repeat], c[repeat]] = False
+        return legal
+
+    def _push_state(self, boards):
+        depth = self.history.shape[1]
+        if self.ko_depth is None and len(boards) and self.pushes[boards].max() >= depth:
+            grown = np.zeros((self.count, depth * 2), dtype=np.uint64)
+            grown[:, :depth] = self.history
+            self.history = grown
+            depth *= 2
+        self.history[boards, self.pushes[boards] % depth] = self.hashes[boards]
+        self.pushes[boards] += 1
+
+    def play(self, rows, cols, players):
+        """ Play one move on every board
+
+        rows and cols give each board's move, with a negative row for a
+        pass. Illegal moves are treated as passes, like Go.place_move
+        does. Returns a mask of the boards where a stone was placed.
+        """
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        players = self._players(players)
+        placed = np.zeros(self.count, dtype=bool)
+        (b,) = np.nonzero(rows >= 0)
+        placed[b] = self.legal_mask(players)[b, rows[b], cols[b]]
+        (b,) = np.nonzero(placed)
+        self.cells[b, rows[b], cols[b]] = players[b]
+        self.hashes[b] ^= self.zobrist[players[b], rows[b], cols[b]]
+        other = (PLAYER1 + PLAYER2 - players).reshape(-1, 1, 1)
+        theirs = (self.cells == other) & placed.reshape(-1, 1, 1)
+        breathing = theirs & (_shifts(self.cells, OFF_BOARD) == EMPTY).any(axis=0)
+        dead = theirs & ~_spread(breathing, theirs)
+        if dead.any():
+            keys = np.where(dead, self.zobrist[other[:, 0, 0]], np.uint64(0))
+            self.hashes ^= np.bitwise_xor.reduce(keys.reshape(self.count, -1), axis=1)
+            self.cells[dead] = EMPTY
+        self._push_state(b)
+        return placed
+
+    def random_moves(self, players, rng=np.random):
+        """ A uniformly random legal move per board, or row -1 to pass """
+        legal = self.legal_mask(players).reshape(self.count, -1)
+        pick = np.argmax(rng.random_sample(legal.shape) * legal, axis=1)
+        rows, cols = np.divmod(pick, self.width)
+        rows[~legal.any(axis=1)] = -1
+        return rows, cols
+
+    def count_scores(self):
+        """ (N, 2) area scores, with KOMI added for PLAYER2 """
+        empty = self.cells == EMPTY
+        scores = np.zeros((self.count, 2))
+        reach = []
+        for player in (PLAYER1, PLAYER2):
+            stones = self.cells == player
+            scores[:, player - 1] = stones.sum(axis=(1, 2))
+            reach.append(_spread(empty & (_shifts(stones, False).any(axis=0)), empty))
+        scores[:, 0] += (reach[0] & ~reach[1]).sum(axis=(1, 2))
+        scores[:, 1] += (reach[1] & ~reach[0]).sum(axis=(1, 2)) + KOMI
+        return scores
+
+    def to_board(self, index):
+        """ board.Board with the stones of one board in the batch """
+        result = board.Board(self.width, self.height, self.ko_depth)
+        result.cell = self.cells[index].tolist()
+        result.rebuild_chains()
+        return result
+
+# End of BatchBoard class
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+""" Per-turn engine cost as the board grows
+
+Plays the same number of random legal moves on each board size and
+times the board calls Go makes every turn: is_legal, place_move,
+push_state, count_scores and the ko marking around to_csv. Rendering
+the field for the bots is timed separately, since that sends every
+point and so has to grow with the area. With the incremental boards the
+rules column should stay roughly flat from 9x9 up to 49x49.
+
+    python benchmarks/board_sizes.py --turns 300 --backend flat
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rules
+
+SIZES = [(9, 9), (19, 19), (29, 29), (39, 39), (49, 49), (49, 19), (13, 41)]
+
+def time_game(backend, width, height, turns, rand):
+    """ Mean seconds per turn spent in the rules and in rendering """
+    board = backend(width, height, track_territory=True)
+    rules_time = 0.0
+    render_time = 0.0
+    for turn in range(0, turns):
+        player = turn % 2
+        owner = board.get_owner(player)
+        # picking the move stands in for the bot and isn't timed
+        empty = [(row, col) for (row, row_cells) in enumerate(board.cell)
+                 for (col, cell) in enumerate(row_cells) if cell == 0]
+        move = rand.choice(empty) if empty else None
+        start = time.time()
+        if move is not None and board.is_legal(owner, move[0], move[1]):
+            board.place_move(owner, move[0], move[1])
+            board.push_state()
+        board.count_scores()
+        board.mark_ko(1 - player)
+        rules_time += time.time() - start
+        start = time.time()
+        board.to_csv()
+        render_time += time.time() - start
+        board.unmark_ko()
+    return (rules_time / turns, render_time / turns)
+
+def main(argv):
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("--turns", dest="turns", type="int", default=200,
+                      help="Moves played on each board")
+    parser.add_option("--games", dest="games", type="int", default=3,
+                      help="Games per board size")
+    parser.add_option("--backend", dest="backend", default="board",
+                      type="choice", choices=sorted(rules.BACKENDS),
+                      help="Rules backend to time")
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+    (opts, args) = parser.parse_args(argv)
+
+    backend = rules.get_backend(opts.backend)
+    print("{0:>7} {1:>12} {2:>12}".format("size", "rules us", "render us"))
+    for (width, height) in SIZES:
+        rand = random.Random(opts.seed)
+        rules_time = 0.0
+        render_time = 0.0
+        for game in range(0, opts.games):
+            (r, t) = time_game(backend, width, height, opts.turns, rand)
+            rules_time += r
+            render_time += t
+        print("{0:>7} {1:>12.1f} {2:>12.1f}".format("{0}x{1}".format(width, height),
+              1e6 * rules_time / opts.games, 1e6 * render_time / opts.games))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+""" Engine throughput and turn latency under synthetic bots
+
+Plays whole games through engine.run_game, each matchup pitting one of
+the synthetic_bot.py modes against an instant bot, and reports:
+
+    games/s       games finished per second of wall time
+    overhead ms   mean per turn of the turn's wall time less the time
+                  get_moves measured the bot taking
+    p50, p99 ms   turn latency: the turn's wall time less what the
+                  moving bot spends on purpose, see synthetic_bot.think_time
+
+With --concurrency above 1 the games are spread over that many worker
+processes, as on an engine host running several games at once. With
+--engine async they are played by async_engine instead, up to
+--concurrency of them at a time in this one process.
+
+    python benchmarks/loadtest.py --games 20 --concurrency 4 --output load.json
+    python benchmarks/loadtest.py --engine async --games 200 --concurrency 200
+"""
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import sys
+import time
+from optparse import OptionParser
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+import engine
+from go import Go
+import synthetic_bot
+
+MATCHUPS = ['instant', 'budget', 'passer', 'flooder', 'spammer']
+
+def percentile(values, fraction):
+    """ Nearest rank percentile of values, None when there are none """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def setup(mode, game_id, turns, turntime, size):
+    """ (game, botcmds, options) for a game of mode against an instant bot """
+    modes = [mode, 'instant']
+    game = Go({
+        'timebank': 0,
+        'time_per_move': turntime,
+        'player_names': modes,
+        'field_width': size,
+        'field_height': size,
+        'print_board': False,
+        'turns': turns,
+    })
+    timings = []
+    options = {
+        'turns': turns,
+        'loadtime': 3000,
+        'turntime': turntime,
+        'ack_turn_zero': True,
+        'game_id': game_id,
+        'turn_timings': timings,
+        'input_logs': None,
+        'output_logs': None,
+        'error_logs': None,
+    }
+    botcmds = [(BENCHMARKS_DIR, "{0} synthetic_bot.py {1}".format(sys.executable, seat_mode))
+               for seat_mode in modes]
+    return (game, botcmds, options)
+
+def timings_of(mode, turntime, options, result, game_seconds):
+    """ The figures run_matchup wants from one played game """
+    modes = [mode, 'instant']
+    latencies = []
+    overheads = []
+    for (turn, seconds, bot_seconds) in options['turn_timings']:
+        if turn == 0:
+            continue
+        # turn t is played by seat (t + 1) % 2, see Go.bots_to_play
+        mover = modes[(turn + 1) % 2]
+        latencies.append(seconds - synthetic_bot.think_time(mover, turntime / 1000.0))
+        overheads.append(seconds - bot_seconds)
+    return {
+        'seconds': game_seconds,
+        'status': result.get('status', [result.get('error', 'error')]),
+        'latencies': latencies,
+        'overheads': overheads,
+    }
+
+class Quiet:
+    """ Sends stdout to devnull, as the engine and Go print as they go """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def play(args):
+    """ Play one game of mode against an instant bot, returning its timings """
+    (mode, game_id, turns, turntime, size) = args
+    (game, botcmds, options) = setup(mode, game_id, turns, turntime, size)
+    start = time.time()
+    with Quiet():
+        result = engine.run_game(game, botcmds, options)
+    return timings_of(mode, turntime, options, result, time.time() - start)
+
+def play_async(work, concurrency):
+    """ play() for every game in work, concurrency at a time in this process """
+    import async_engine
+    games = [setup(*args) for args in work]
+    start = time.time()
+    with Quiet():
+        results = asyncio.run(async_engine.run_games(games, concurrency))
+    seconds = time.time() - start
+    return [timings_of(args[0], args[3], options, result, seconds)
+            for (args, (game, botcmds, options), result) in zip(work, games, results)]
+
+def run_matchup(mode, games, concurrency, turns, turntime, size, first_id, use_async=False):
+    work = [(mode, first_id + game, turns, turntime, size) for game in range(0, games)]
+    start = time.time()
+    if use_async:
+        played = play_async(work, concurrency)
+    elif concurrency > 1:
+        pool = multiprocessing.Pool(concurrency)
+        try:
+            played = pool.map(play, work)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        played = [play(args) for args in work]
+    wall = time.time() - start
+    latencies = [latency for game in played for latency in game['latencies']]
+    overheads = [overhead for game in played for overhead in game['overheads']]
+    statuses = {}
+    for game in played:
+        for status in game['status']:
+            statuses[status] = statuses.get(status, 0) + 1
+    ms = lambda seconds: None if seconds is None else round(1000 * seconds, 3)
+    return {
+        'games': games,
+        'concurrency': concurrency,
+        'turns': len(latencies),
+        'wall_seconds': round(wall, 3),
+        'games_per_second': round(games / wall, 3),
+        'turns_per_second': round(len(latencies) / wall, 1),
+        'overhead_ms': ms(sum(overheads) / len(overheads) if overheads else None),
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(max(latencies) if latencies else None),
+        'statuses': statuses,
+    }
+
+def main(argv):
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("--matchup", dest="matchups", action="append",
+                      type="choice", choices=MATCHUPS,
+                      help="Bot mode to play against an instant bot, repeat for several; all by default")
+    parser.add_option("--games", dest="games", type="int", default=10,
+                      help="Games per matchup")
+    parser.add_option("--concurrency", dest="concurrency", type="int", default=1,
+                      help="Games played at once, each in its own process unless --engine is async")
+    parser.add_option("--engine", dest="engine", default="sync", type="choice",
+                      choices=["sync", "async"],
+                      help="engine.run_game, or async_engine.run_game for every game in one process")
+    parser.add_option("--turns", dest="turns", type="int", default=100,
+                      help="Turns per game at most")
+    parser.add_option("--turntime", dest="turntime", type="int", default=100,
+                      help="Milliseconds each bot gets per move")
+    parser.add_option("--size", dest="size", type="int", default=19,
+                      help="Field width and height")
+    parser.add_option("--output", dest="output", default=None,
+                      help="Also write the results as JSON here")
+    (opts, args) = parser.parse_args(argv)
+
+    results = {}
+    print("{0:<9} {1:>8} {2:>8} {3:>11} {4:>8} {5:>8}  {6}".format(
+        "matchup", "games/s", "turns/s", "overhead ms", "p50 ms", "p99 ms", "statuses"))
+    for (index, mode) in enumerate(opts.matchups or MATCHUPS):
+        report = run_matchup(mode, opts.games, opts.concurrency, opts.turns, opts.turntime,
+                             opts.size, index * opts.games, opts.engine == 'async')
+        results[mode] = report
+        # !s as the latencies are None when no turn was played
+        print("{0:<9} {1!s:>8} {2!s:>8} {3!s:>11} {4!s:>8} {5!s:>8}  {6}".format(
+            mode, report['games_per_second'], report['turns_per_second'], report['overhead_ms'],
+            report['p50_ms'], report['p99_ms'],
+            " ".join("{0}:{1}".format(status, count)
+                     for (status, count) in sorted(report['statuses'].items()))))
+    if opts.output:
+        with open(opts.output, 'w') as output:
+            json.dump({'options': vars(opts), 'results': results}, output, indent=1, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
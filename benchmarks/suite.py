@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+""" Board hot path benchmarks on recorded and synthetic positions
+
+Times the board calls Go makes, one call at a time, on 9x9, 13x13 and
+19x19 positions:
+
+    place_move, push_state, legal_moves, count_scores
+        after one of the side to move's legal moves, captures first,
+        each on a freshly built copy of the position
+    not_ko        every empty point for the side to move
+    mark_ko       marking the side to move's ko points, unmark_ko untimed
+    to_csv        rendering the field
+    parse         reading that field into an empty board
+
+Positions come from positions.json, recorded with --record from seeded
+playouts or from revision 2 replays, so the numbers don't move when the
+playout code does. Two synthetic worst cases are built on every size:
+snake, one chain winding through every other row, and fill_capture, a
+board one colour owns but for the single point that captures it all.
+
+Results are written as JSON, keyed "<size>/<position>/<call>" with the
+median and fastest microseconds per call. --compare checks the fastest
+against a saved run and exits 1 if any call got slower than --tolerance
+allows.
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json
+    python benchmarks/suite.py --record benchmarks/positions.json
+"""
+from __future__ import print_function
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import board
+import rules
+
+SIZES = [(9, 9), (13, 13), (19, 19)]
+POSITIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'positions.json')
+CALLS = ['place_move', 'push_state', 'legal_moves', 'count_scores',
+         'not_ko', 'mark_ko', 'to_csv', 'parse']
+RECORD_GAMES = 20
+
+timer = getattr(time, 'perf_counter', time.time)
+
+def build(backend, position):
+    """ A backend board holding position, moves played through place_move """
+    result = backend(position['width'], position['height'], board.KO_BOARDS,
+                     track_territory=True)
+    if 'field' in position:
+        result.parse(position['field'])
+    for move in position.get('moves', []):
+        if len(move) == 3:
+            (player, row, col) = move
+            result.place_move(result.get_owner(player), row, col)
+        result.push_state()
+    return result
+
+def sample_moves(position, count, rand):
+    """ Up to count legal moves for the side to move, captures first """
+    reference = build(board.Board, position)
+    owner = reference.get_owner(position['to_move'])
+    legal = reference.legal_moves(owner)
+    captures = [move for move in legal if reference.is_capture(owner, move[0], move[1])]
+    others = [move for move in legal if move not in captures]
+    rand.shuffle(others)
+    return (captures + others)[:count]
+
+def snake(width, height):
+    """ PLAYER1 in one chain over the even rows, joined at alternate ends """
+    cells = []
+    for row in range(0, height):
+        for col in range(0, width):
+            if row % 2 == 0:
+                cells.append(board.PLAYER1)
+            elif row % 4 == 1:
+                cells.append(board.PLAYER1 if col == width - 1 else board.EMPTY)
+            else:
+                cells.append(board.PLAYER1 if col == 0 else board.EMPTY)
+    return {'width': width, 'height': height, 'to_move': 1,
+            'field': ",".join([str(cell) for cell in cells])}
+
+def fill_capture(width, height):
+    """ PLAYER1 everywhere but the centre, where PLAYER2 takes the lot """
+    cells = [board.PLAYER1] * (width * height)
+    cells[(height // 2) * width + width // 2] = board.EMPTY
+    return {'width': width, 'height': height, 'to_move': 1,
+            'field': ",".join([str(cell) for cell in cells])}
+
+SYNTHETIC = [('snake', snake), ('fill_capture', fill_capture)]
+
+def time_calls(backend, position, samples, repeat, rand):
+    """ {call: [seconds, ...]} for one position """
+    times = dict((call, []) for call in CALLS)
+    player = position['to_move']
+    moves = sample_moves(position, samples, rand)
+    # positions with few legal moves time them over again
+    for index in range(0, samples if moves else 0):
+        (row, col) = moves[index % len(moves)]
+        current = build(backend, position)
+        owner = current.get_owner(player)
+        start = timer()
+        current.place_move(owner, row, col)
+        times['place_move'].append(timer() - start)
+        start = timer()
+        current.push_state()
+        times['push_state'].append(timer() - start)
+        start = timer()
+        current.legal_moves(current.get_owner(1 - player))
+        times['legal_moves'].append(timer() - start)
+        start = timer()
+        current.count_scores()
+        times['count_scores'].append(timer() - start)
+
+    current = build(backend, position)
+    owner = current.get_owner(player)
+    field = current.to_csv()
+    empty = [(row, col) for (row, cells) in enumerate(current.cell)
+             for (col, cell) in enumerate(cells) if cell == board.EMPTY]
+    for trial in range(0, repeat):
+        if hasattr(current, 'not_ko'):
+            for (row, col) in empty:
+                start = timer()
+                current.not_ko(owner, row, col)
+                times['not_ko'].append(timer() - start)
+        start = timer()
+        current.mark_ko(player)
+        times['mark_ko'].append(timer() - start)
+        current.unmark_ko()
+        start = timer()
+        current.to_csv()
+        times['to_csv'].append(timer() - start)
+        blank = backend(position['width'], position['height'], board.KO_BOARDS,
+                        track_territory=True)
+        start = timer()
+        blank.parse(field)
+        times['parse'].append(timer() - start)
+    return times
+
+def summarize(seconds):
+    ordered = sorted(seconds)
+    return {'median_us': round(1e6 * ordered[len(ordered) // 2], 3),
+            'min_us': round(1e6 * ordered[0], 3),
+            'calls': len(ordered)}
+
+def positions_for(recorded, width, height):
+    """ [(name, position)] to time on one board size """
+    size = "{0}x{1}".format(width, height)
+    named = [(name.split('/', 1)[1], position) for (name, position) in sorted(recorded.items())
+             if name.split('/', 1)[0] == size]
+    return named + [(name, make(width, height)) for (name, make) in SYNTHETIC]
+
+def run(backend, recorded, samples, repeat, seed):
+    results = {}
+    for (width, height) in SIZES:
+        size = "{0}x{1}".format(width, height)
+        for (name, position) in positions_for(recorded, width, height):
+            # as timeit does, so a collection doesn't land in one call's time
+            gc.collect()
+            gc.disable()
+            try:
+                times = time_calls(backend, position, samples, repeat, random.Random(seed))
+            finally:
+                gc.enable()
+            for call in CALLS:
+                if times[call]:
+                    results["{0}/{1}/{2}".format(size, name, call)] = summarize(times[call])
+    return results
+
+def compare(results, baseline, tolerance, floor):
+    """ Print each call against the baseline and return the regressed keys
+
+    Calls are compared by their fastest time, which other load on the
+    machine disturbs far less than the median. Differences within floor
+    microseconds are never flagged, as they're mostly timer noise.
+    """
+    regressions = []
+    print("{0:<32} {1:>11} {2:>11} {3:>7}".format("call", "baseline us", "now us", "ratio"))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        before = baseline[key]['min_us']
+        now = results[key]['min_us']
+        ratio = now / before if before else 1.0
+        flag = ""
+        if abs(now - before) <= floor:
+            pass
+        elif ratio > 1.0 + tolerance:
+            regressions.append(key)
+            flag = " slower"
+        elif ratio < 1.0 - tolerance:
+            flag = " faster"
+        print("{0:<32} {1:>11.2f} {2:>11.2f} {3:>7.2f}{4}".format(key, before, now, ratio, flag))
+    return regressions
+
+def playout(width, height, rand):
+    """ A random playout that doesn't fill its own eyes
+
+    Yields (moves so far, board) after every move; both are live, so
+    copy what has to be kept.
+    """
+    position = board.Board(width, height, board.KO_BOARDS, track_territory=True)
+    neighbours = board.neighbour_table(width, height)
+    moves = []
+    passes = 0
+    player = 0
+    while passes < 2 and len(moves) < 3 * width * height:
+        owner = position.get_owner(player)
+        candidates = [(row, col) for (row, col) in position.legal_moves(owner)
+                      if any(position.cell[r][c] != owner for (r, c) in neighbours[(row, col)])]
+        if candidates:
+            (row, col) = rand.choice(candidates)
+            position.place_move(owner, row, col)
+            moves.append([player, row, col])
+            passes = 0
+        else:
+            moves.append([player])
+            passes += 1
+        position.push_state()
+        player = 1 - player
+        yield (moves, position)
+
+def replay_positions(path, width, height):
+    """ Like playout, for the moves of a revision 2 replay of this size """
+    with open(path, 'r') as replay_file:
+        replaydata = json.load(replay_file).get('replaydata', {})
+    if replaydata.get('revision') != 2 or (replaydata['cols'], replaydata['rows']) != (width, height):
+        return
+    position = board.Board(width, height, board.KO_BOARDS, track_territory=True)
+    moves = []
+    for move in replaydata['moves']:
+        # the first turns hand out the empty field before anyone moves
+        if not move:
+            continue
+        if len(move) == 3:
+            (player, row, col) = move
+            position.place_move(position.get_owner(player), row, col)
+        moves.append(move)
+        position.push_state()
+        yield (moves, position)
+
+def atari_stones(position, player):
+    """ Stones the side to move could capture right away """
+    owner = position.get_owner(player)
+    return sum(len(chain.stones) for chain in position.atari[board.PLAYER1 + board.PLAYER2 - owner])
+
+def ko_points(position, player):
+    return len(position._ko_points(position.get_owner(player)))
+
+def record(games, width, height):
+    """ {name: position} picked from games of (moves, board) sequences
+
+    midgame is the first game once half the points have been played,
+    capture_heavy has the most stones in atari for the side to move,
+    ko_heavy the most ko points for it.
+    """
+    size = "{0}x{1}".format(width, height)
+    best = {}
+    for (game, positions) in enumerate(games):
+        for (moves, position) in positions:
+            player = len(moves) % 2
+            atari = atari_stones(position, player)
+            scores = {'capture_heavy': (atari, len(moves)),
+                      'ko_heavy': (ko_points(position, player), atari)}
+            if game == 0 and len(moves) == width * height // 2:
+                scores['midgame'] = (1, 0)
+            for (name, score) in scores.items():
+                if name not in best or score > best[name][0]:
+                    best[name] = (score, list(moves))
+    return dict(("{0}/{1}".format(size, name),
+                 {'width': width, 'height': height, 'to_move': len(moves) % 2, 'moves': moves})
+                for (name, (score, moves)) in best.items())
+
+def main(argv):
+    parser = OptionParser(usage="Usage: %prog [options] [revision 2 replays to record from]")
+    parser.add_option("--backend", dest="backend", default="board",
+                      type="choice", choices=sorted(rules.BACKENDS),
+                      help="Rules backend to time")
+    parser.add_option("--positions", dest="positions", default=POSITIONS_FILE,
+                      help="Recorded positions to time")
+    parser.add_option("--samples", dest="samples", type="int", default=30,
+                      help="Moves timed per position")
+    parser.add_option("--repeat", dest="repeat", type="int", default=30,
+                      help="Times each static call is repeated per position")
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+    parser.add_option("--output", dest="output", default=None,
+                      help="Write the results here rather than to stdout")
+    parser.add_option("--compare", dest="compare", default=None,
+                      help="Saved results to compare against")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=0.25,
+                      help="Slowdown allowed before --compare fails")
+    parser.add_option("--floor", dest="floor", type="float", default=2.0,
+                      help="Microseconds of difference --compare always ignores")
+    parser.add_option("--record", dest="record", default=None,
+                      help="Record positions from playouts, or the replays given, to this file")
+    (opts, args) = parser.parse_args(argv)
+
+    if opts.record:
+        rand = random.Random(opts.seed)
+        recorded = {}
+        for (width, height) in SIZES:
+            if args:
+                games = [replay_positions(path, width, height) for path in args]
+            else:
+                games = [playout(width, height, rand) for game in range(0, RECORD_GAMES)]
+            recorded.update(record(games, width, height))
+        with open(opts.record, 'w') as positions_file:
+            # a position per line keeps the file diffable
+            positions_file.write("{\n" + ",\n".join(
+                "{0}: {1}".format(json.dumps(name), json.dumps(recorded[name], sort_keys=True,
+                                                               separators=(',', ':')))
+                for name in sorted(recorded)) + "\n}\n")
+        print("recorded {0} positions to {1}".format(len(recorded), opts.record))
+        return 0
+
+    with open(opts.positions, 'r') as positions_file:
+        recorded = json.load(positions_file)
+    results = {
+        'meta': {
+            'backend': opts.backend,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'samples': opts.samples,
+            'repeat': opts.repeat,
+            'seed': opts.seed,
+        },
+        'results': run(rules.get_backend(opts.backend), recorded, opts.samples,
+                       opts.repeat, opts.seed),
+    }
+    if opts.output:
+        with open(opts.output, 'w') as output:
+            json.dump(results, output, indent=1, sort_keys=True)
+    elif not opts.compare:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print()
+    if opts.compare:
+        with open(opts.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results['results'], baseline['results'], opts.tolerance,
+                              opts.floor)
+        if regressions:
+            print("{0} calls slower than the baseline by over {1:.0%}".format(
+                len(regressions), opts.tolerance))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+""" Synthetic bots for load testing the engine
+
+    python synthetic_bot.py <mode>
+
+Every mode acknowledges the settings at once and then answers only
+"action move", so the time the engine spends on a turn is all its own
+but for what the mode spends on purpose:
+
+    instant   places a stone on a random empty point straight away
+    budget    the same after sleeping BUDGET_FRACTION of its time budget
+    passer    passes every turn
+    flooder   writes FLOOD_LINES lines to stderr, then moves
+    spammer   writes SPAM_LINES comment lines, well under the
+              engine.MOVE_LINES a turn may have, then moves
+
+A stone on a point that turns out to be illegal is taken as a pass by
+the engine, which is fine for load.
+"""
+from __future__ import print_function
+import random
+import sys
+import time
+
+MODES = ['instant', 'budget', 'passer', 'flooder', 'spammer']
+BUDGET_FRACTION = 0.9
+FLOOD_LINES = 1000
+SPAM_LINES = 1000
+
+def think_time(mode, budget):
+    """ Seconds a mode sleeps on purpose given its budget in seconds """
+    if mode == 'budget':
+        return BUDGET_FRACTION * budget
+    return 0.0
+
+def random_empty(field, width, rand):
+    empty = [index for (index, cell) in enumerate(field.split(',')) if cell == '0']
+    if not empty:
+        return None
+    index = rand.choice(empty)
+    return (index % width, index // width)
+
+def main(argv):
+    mode = argv[0] if argv else 'instant'
+    if mode not in MODES:
+        sys.stderr.write("unknown mode {0}, expected one of {1}\n".format(mode, ", ".join(MODES)))
+        return 1
+    rand = random.Random()
+    width = 19
+    field = ''
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            return 0
+        tokens = line.split()
+        if tokens[:2] == ['settings', 'field_width']:
+            width = int(tokens[2])
+        elif tokens[:2] == ['settings', 'max_rounds']:
+            # the last of the settings; turn 0 ends on any move, which is ignored
+            sys.stdout.write("pass\n")
+            sys.stdout.flush()
+        elif tokens[:3] == ['update', 'game', 'field']:
+            field = tokens[3]
+        elif tokens[:2] == ['action', 'move']:
+            budget = int(tokens[2]) / 1000.0
+            out = []
+            if mode == 'budget':
+                time.sleep(think_time(mode, budget))
+            elif mode == 'flooder':
+                sys.stderr.write("flooding stderr\n" * FLOOD_LINES)
+                sys.stderr.flush()
+            elif mode == 'spammer':
+                out.append("# spam\n" * SPAM_LINES)
+            point = None if mode == 'passer' else random_empty(field, width, rand)
+            if point is None:
+                out.append("pass\n")
+            else:
+                out.append("place_move {0} {1}\n".format(point[0], point[1]))
+            sys.stdout.write(''.join(out))
+            sys.stdout.flush()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
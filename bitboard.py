@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+""" Go board kept as two Python ints, one bit per point
+
+Bit row * stride + col stands for (row, col). The stride is width + 1,
+so every row ends in a guard bit that is never set, and shifting by one
+can't carry a stone over into the next row. Chains, liberties and
+territory are found by dilation: shift a mask one step each way, OR the
+shifts together and AND with the points that may be reached. Each step
+is a handful of C-level big-int operations, with no per-point Python
+work.
+
+BitBoard has the same interface as board.Board for everything Go uses,
+so either one can be passed as the Go option board_class.
+"""
+from collections import deque
+
+from board import EMPTY, PLAYER1, PLAYER2, KO, KO_BOARDS, SIMPLE_KO_BOARDS, KOMI, \
+    CSV_VALUES, zobrist_table
+
+_BITS = {}
+
+def bit_tables(width, height):
+    """ Per-size tables for BitBoard
+
+    Returns the row stride, a mask of every on-board bit, and the
+    Zobrist keys indexed by bit number.
+    """
+    key = (width, height)
+    tables = _BITS.get(key)
+    if tables is None:
+        stride = width + 1
+        on_board = 0
+        zobrist = [None] * (stride * height)
+        keys = zobrist_table(width, height)
+        for row in range(0, height):
+            for col in range(0, width):
+                on_board |= 1 << (row * stride + col)
+                zobrist[row * stride + col] = keys[(row, col)]
+        tables = (stride, on_board, zobrist)
+        _BITS[key] = tables
+    return tables
+
+def bit_indices(mask):
+    """ Bit numbers set in mask, lowest first """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+
+class BitBoard:
+
+    def get_owner(self, player):
+        owner = PLAYER2
+        if player == 0:
+            owner = PLAYER1
+        return owner
+
+    def __init__(self, width, height, ko_depth=KO_BOARDS, track_territory=False):
+        # track_territory is accepted for compatibility with board.Board;
+        # scoring floods the empty mask directly, which is already cheap
+        self.width = width
+        self.height = height
+        (self.stride, self.on_board, self.zobrist) = bit_tables(width, height)
+        self.stones = [0, 0, 0]
+        self.hash = 0
+        self.ko_point = None
+        self.ko_player = EMPTY
+        self.ko_marks = 0
+        self.undo_log = []
+        self.ko_depth = ko_depth
+        self.history = deque()
+        self.history_counts = {}
+
+    def _bit(self, row, col):
+        return 1 << (row * self.stride + col)
+
+    def _coords(self, index):
+        return divmod(index, self.stride)
+
+    def _dilate(self, mask):
+        """ mask plus every point next to it """
+        stride = self.stride
+        return (mask | (mask << 1) | (mask >> 1) | (mask << stride) | (mask >> stride)) & self.on_board
+
+    def _flood(self, seed, within):
+        """ The points of within connected to seed """
+        reached = seed
+        while True:
+            grown = self._dilate(reached) & within
+            if grown == reached:
+                return reached
+            reached = grown
+
+    def empty(self):
+        return self.on_board & ~(self.stones[PLAYER1] | self.stones[PLAYER2])
+
+    @property
+    def cell(self):
+        """ The position as a list of rows, like board.Board.cell
+
+        This is a fresh copy, so writing to it doesn't change the board.
+        """
+        rows = []
+        for row in range(0, self.height):
+            rows.append([self._cell_at(1 << (row * self.stride + col)) for col in range(0, self.width)])
+        return rows
+
+    def _cell_at(self, bit):
+        if self.stones[PLAYER1] & bit:
+            return PLAYER1
+        elif self.stones[PLAYER2] & bit:
+            return PLAYER2
+        elif self.ko_marks & bit:
+            return KO
+        return EMPTY
+
+    def parse(self, data):
+        self.stones = [0, 0, 0]
+        self.hash = 0
+        for (i, cell) in enumerate(data.split(',')):
+            color = int(cell)
+            if color == PLAYER1 or color == PLAYER2:
+                index = (i // self.width) * self.stride + i % self.width
+                self.stones[color] |= 1 << index
+                self.hash ^= self.zobrist[index][color]
+
+    def copy(self):
+        board = self.__class__(self.width, self.height, self.ko_depth)
+        board.stones = list(self.stones)
+        board.hash = self.hash
+        board.ko_point = self.ko_point
+        board.ko_player = self.ko_player
+        board.undo_log = list(self.undo_log)
+        board.history = deque(self.history)
+        board.history_counts = dict(self.history_counts)
+        return board
+
+    def get_chain(self, row, col):
+        """ The chain through (row, col) as a set of (row, col) """
+        bit = self._bit(row, col)
+        for color in (PLAYER1, PLAYER2):
+            if self.stones[color] & bit:
+                return set(self._coords(i) for i in bit_indices(self._flood(bit, self.stones[color])))
+        return set()
+
+    def count_liberties(self, row, col):
+        bit = self._bit(row, col)
+        for color in (PLAYER1, PLAYER2):
+            if self.stones[color] & bit:
+                return popcount(self._dilate(self._flood(bit, self.stones[color])) & self.empty())
+        return 0
+
+    def _captures(self, player, bit):
+        """ Stones of the opponent that player would capture at bit """
+        other = PLAYER1 + PLAYER2 - player
+        theirs = self.stones[other]
+        empty = self.empty() & ~bit
+        captured = 0
+        around = self._dilate(bit) & theirs
+        while around:
+            chain = self._flood(around & -around, theirs)
+            if not self._dilate(chain) & empty:
+                captured |= chain
+            around &= ~chain
+        return captured
+
+    def not_suicide(self, player, row, col):
+        bit = self._bit(row, col)
+        empty = self.empty() & ~bit
+        if self._dilate(self._flood(bit, self.stones[player] | bit)) & empty:
+            return True
+        return self._captures(player, bit) != 0
+
+    def is_capture(self, player, row, col):
+        return self._captures(player, self._bit(row, col)) != 0
+
+    def hash_after(self, player, row, col):
+        """ Zobrist hash of the position after player places at (row, col) """
+        index = row * self.stride + col
+        return self._hash_after(player, index, self._captures(player, 1 << index))
+
+    def _hash_after(self, player, index, captured):
+        result = self.hash ^ self.zobrist[index][player]
+        other = PLAYER1 + PLAYER2 - player
+        for stone in bit_indices(captured):
+            result ^= self.zobrist[stone][other]
+        return result
+
+    def is_legal(self, player, row, col):
+        """ Check one move: empty, not suicide, not a repeat of a recent position """
+        if row < 0 or row >= self.height or col < 0 or col >= self.width:
+            return False
+        return self._is_legal(player, row * self.stride + col)
+
+    def _is_legal(self, player, index):
+        bit = 1 << index
+        empty = self.empty()
+        if not empty & bit:
+            return False
+        captured = self._captures(player, bit)
+        if captured:
+            return self._hash_after(player, index, captured) not in self.history_counts
+        return self._dilate(self._flood(bit, self.stones[player] | bit)) & empty & ~bit != 0
+
+    def legal_moves(self, player):
+        return [self._coords(index) for index in bit_indices(self.empty())
+            if self._is_legal(player, index)]
+
+    def place_move(self, owner, row, col):
+        """ Place a stone and remove the groups it captures
+
+        Returns the (row, col) of every captured stone.
+        """
+        index = row * self.stride + col
+        bit = 1 << index
+        other = PLAYER1 + PLAYER2 - owner
+        captured = self._captures(owner, bit)
+        self.stones[owner] |= bit
+        self.stones[other] &= ~captured
+        self.hash ^= self.zobrist[index][owner]
+        for stone in bit_indices(captured):
+            self.hash ^= self.zobrist[stone][other]
+        # a lone stone that took a lone stone and has only that point as liberty
+        if (popcount(captured) == 1 and not self._dilate(bit) & self.stones[owner] & ~bit
+                and popcount(self._dilate(bit) & self.empty()) == 1):
+            self.ko_point = captured.bit_length() - 1
+            self.ko_player = other
+        else:
+            self.ko_point = None
+            self.ko_player = EMPTY
+        return [self._coords(stone) for stone in bit_indices(captured)]
+
+    def play(self, owner, row, col):
+        """ place_move and push_state, remembering enough to undo() them """
+        entry = (owner, self._bit(row, col), self.hash, self.ko_point, self.ko_player)
+        before = self.stones[PLAYER1 + PLAYER2 - owner]
+        captured = self.place_move(owner, row, col)
+        evicted = None
+        if self.ko_depth is not None and len(self.history) >= self.ko_depth:
+            evicted = self.history[0]
+        self.push_state()
+        self.undo_log.append(entry + (before, evicted))
+        return captured
+
+    def undo(self):
+        """ Take back the last play() """
+        (owner, bit, prev_hash, ko_point, ko_player, before, evicted) = self.undo_log.pop()
+        self._pop_state()
+        if evicted is not None:
+            self.history.appendleft(evicted)
+            self.history_counts[evicted] = self.history_counts.get(evicted, 0) + 1
+        self.stones[owner] &= ~bit
+        self.stones[PLAYER1 + PLAYER2 - owner] = before
+        self.hash = prev_hash
+        self.ko_point = ko_point
+        self.ko_player = ko_player
+
+    def count_scores(self):
+        """ Area scores: stones plus surrounded empty regions, KOMI to PLAYER2 """
+        empty = self.empty()
+        reach = [0, 0, 0]
+        for player in (PLAYER1, PLAYER2):
+            reach[player] = self._flood(self._dilate(self.stones[player]) & empty, empty)
+        scores = [popcount(self.stones[PLAYER1]) + popcount(reach[PLAYER1] & ~reach[PLAYER2]),
+                  popcount(self.stones[PLAYER2]) + popcount(reach[PLAYER2] & ~reach[PLAYER1])]
+        scores[1] += KOMI
+        return scores
+
+    def _ko_points(self, player):
+        """ Bits player may not play because of ko
+
+        Under simple ko the only candidate is the point left by the last
+        capture, otherwise the last liberties of the opponent's chains
+        in atari.
+        """
+        empty = self.empty()
+        if self.ko_depth is not None and self.ko_depth <= SIMPLE_KO_BOARDS:
+            candidates = 0
+            if self.ko_point is not None and self.ko_player == player:
+                candidates = 1 << self.ko_point
+        else:
+            candidates = 0
+            theirs = self.stones[PLAYER1 + PLAYER2 - player]
+            while theirs:
+                chain = self._flood(theirs & -theirs, theirs)
+                liberties = self._dilate(chain) & empty
+                if liberties & (liberties - 1) == 0:
+                    candidates |= liberties
+                theirs &= ~chain
+        ko_points = 0
+        for index in bit_indices(candidates):
+            captured = self._captures(player, 1 << index)
+            if captured and self._hash_after(player, index, captured) in self.history_counts:
+                ko_points |= 1 << index
+        return ko_points
+
+    def collapse_array(self):
+        return [cell for row in self.cell for cell in row]
+
+    def push_state(self):
+        self.history.append(self.hash)
+        self.history_counts[self.hash] = self.history_counts.get(self.hash, 0) + 1
+        if self.ko_depth is not None and len(self.history) > self.ko_depth:
+            old = self.history.popleft()
+            if self.history_counts[old] == 1:
+                del self.history_counts[old]
+            else:
+                self.history_counts[old] -= 1
+
+    def _pop_state(self):
+        last = self.history.pop()
+        if self.history_counts[last] == 1:
+            del self.history_counts[last]
+        else:
+            self.history_counts[last] -= 1
+
+    def text_board(self):
+        symbols = {EMPTY: ".", PLAYER1: "o", PLAYER2: "x"}
+        for row in self.cell:
+            print(" ".join([symbols.get(i, "-") for i in row]))
+
+    def to_csv(self):
+        return ",".join([CSV_VALUES.get(cell, "0") for cell in self.collapse_array()])
+
+    def mark_ko(self, player):
+        self.ko_marks = self._ko_points(self.get_owner(player))
+
+    def unmark_ko(self):
+        self.ko_marks = 0
+
+# End of BitBoard class
@@ -1,6 +1,11 @@
-import copy
+import random
+from array import array
+from collections import deque
+from itertools import chain
 
 EMPTY, PLAYER1, PLAYER2, KO, LIBERTY = [0, 1, 2, -1, 3]
+# Fills the frame around a FlatBoard so neighbour offsets never leave the array
+BORDER = 4
 
 ADJACENT = [
     (-1, 0),
@@ -9,8 +14,209 @@ ADJACENT = [
     (0, -1)
 ]
 
+# How many previous positions are checked for ko; None checks the whole game
 KO_BOARDS = 101
+# With this little history only the position before the opponent's move
+# can repeat, which is the simple ko rule
+SIMPLE_KO_BOARDS = 2
 KOMI = 7.5
+# field_checksum wraps at this value
+CHECKSUM_MODULUS = 2 ** 32
+
+ZOBRIST_SEED = 20161
+_ZOBRIST = {}
+_NEIGHBOURS = {}
+_ADJACENT = {}
+_RING = {}
+_FLAT = {}
+
+def zobrist_table(width, height):
+    """ Map each (row, col) to random 64-bit keys, indexed by stone colour.
+
+    The keys come from a fixed seed so hashes are reproducible between
+    boards and between runs, and don't disturb the game's own random state.
+    """
+    key = (width, height)
+    table = _ZOBRIST.get(key)
+    if table is None:
+        rand = random.Random(ZOBRIST_SEED)
+        table = {}
+        for row in range(0, height):
+            for col in range(0, width):
+                table[(row, col)] = (0, rand.getrandbits(64), rand.getrandbits(64))
+        _ZOBRIST[key] = table
+    return table
+
+def neighbour_table(width, height):
+    """ Map each (row, col) on a width x height board to its on-board neighbours.
+
+    Tables are built once per board size and shared between boards.
+    """
+    key = (width, height)
+    table = _NEIGHBOURS.get(key)
+    if table is None:
+        table = {}
+        for row in range(0, height):
+            for col in range(0, width):
+                table[(row, col)] = tuple((row + ro, col + co) for (ro, co) in ADJACENT
+                    if 0 <= row + ro < height and 0 <= col + co < width)
+        _NEIGHBOURS[key] = table
+    return table
+
+def adjacent_table(width, height):
+    """ Map each (row, col) to the list Board.get_adjacent returns for it.
+
+    The lists are shared, so callers must not modify them.
+    """
+    key = (width, height)
+    table = _ADJACENT.get(key)
+    if table is None:
+        table = {}
+        for row in range(0, height):
+            for col in range(0, width):
+                adjacent = []
+                for (ro, co) in ADJACENT:
+                    tr = row + ro
+                    tc = col + co
+                    adjacent.append((0 <= tr < height and 0 <= tc < width, (tr, tc)))
+                table[(row, col)] = adjacent
+        _ADJACENT[key] = table
+    return table
+
+def ring_table(width, height):
+    """ Map each (row, col) to the eight points around it, clockwise from north.
+
+    Points off the board are None.
+    """
+    key = (width, height)
+    table = _RING.get(key)
+    if table is None:
+        table = {}
+        offsets = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+        for row in range(0, height):
+            for col in range(0, width):
+                table[(row, col)] = tuple((row + ro, col + co)
+                    if 0 <= row + ro < height and 0 <= col + co < width else None
+                    for (ro, co) in offsets)
+        _RING[key] = table
+    return table
+
+def flat_tables(width, height):
+    """ Per-size tables for FlatBoard.
+
+    Returns the padded row stride, the flat index of every on-board point
+    in row-major order, the on-board neighbours of each index, an empty
+    padded board to copy from, and the Zobrist keys and surrounding ring
+    by flat index.
+    """
+    key = (width, height)
+    tables = _FLAT.get(key)
+    if tables is None:
+        stride = width + 2
+        size = stride * (height + 2)
+        points = [(row + 1) * stride + col + 1 for row in range(0, height) for col in range(0, width)]
+        blank = array('b', [BORDER] * size)
+        for point in points:
+            blank[point] = EMPTY
+        offsets = [ro * stride + co for (ro, co) in ADJACENT]
+        neighbours = [()] * size
+        zobrist = [None] * size
+        ring = [None] * size
+        keys = zobrist_table(width, height)
+        rings = ring_table(width, height)
+        for point in points:
+            neighbours[point] = tuple(point + offset for offset in offsets
+                if blank[point + offset] != BORDER)
+            row, col = divmod(point, stride)
+            zobrist[point] = keys[(row - 1, col - 1)]
+            ring[point] = tuple(None if around is None else (around[0] + 1) * stride + around[1] + 1
+                for around in rings[(row - 1, col - 1)])
+        tables = (stride, points, neighbours, blank, zobrist, ring)
+        _FLAT[key] = tables
+    return tables
+
+def field_checksum(values):
+    """ Checksum of a field given as its cell values in row-major order
+
+    Each cell adds (index + 1) * (value + 2), so a change from a to b at
+    index i moves the sum by (i + 1) * (b - a) and can be applied
+    without going over the whole field again.
+    """
+    total = 0
+    for (index, value) in enumerate(values):
+        total += (index + 1) * (value + 2)
+    return total % CHECKSUM_MODULUS
+
+# The packed field encoding gives each cell a 2-bit code and puts three
+# cells in every base64 character, first cell in the high bits
+PACKED_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+PACKED_VALUES = [EMPTY, PLAYER1, PLAYER2, KO]
+_PACKED_ENCODE = {}
+_PACKED_DECODE = {}
+for (_index, _char) in enumerate(PACKED_ALPHABET):
+    _cells = (PACKED_VALUES[_index >> 4], PACKED_VALUES[(_index >> 2) & 3], PACKED_VALUES[_index & 3])
+    _PACKED_ENCODE[_cells] = _char
+    _PACKED_DECODE[_char] = _cells
+
+def encode_field(values):
+    """ Pack cell values, row-major, into ceil(len / 3) base64 characters
+
+    The last character is padded with EMPTY.
+    """
+    cells = list(values) + [EMPTY, EMPTY]
+    triples = iter(cells[:len(cells) - (len(cells) % 3)])
+    return ''.join(map(_PACKED_ENCODE.__getitem__, zip(triples, triples, triples)))
+
+def decode_field(data, count):
+    """ The first count cell values of a packed field """
+    return list(chain.from_iterable(map(_PACKED_DECODE.__getitem__, data)))[:count]
+
+
+class Chain:
+    """ A group of connected stones of one colour.
+
+    The board keeps one Chain per group and updates it incrementally as
+    stones are placed and captured, so liberty questions never need a
+    flood fill.
+    """
+
+    def __init__(self, color, rep):
+        self.color = color
+        self.rep = rep
+        self.stones = set([rep])
+        self.liberties = set()
+
+    def copy(self):
+        chain = Chain(self.color, self.rep)
+        chain.stones = set(self.stones)
+        chain.liberties = set(self.liberties)
+        return chain
+
+
+class Region:
+    """ A connected area of empty points.
+
+    edges counts the (empty point, stone) adjacencies per stone colour,
+    which is enough to tell when the region stops or starts being one
+    player's territory.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.edges = [0, 0, 0]
+
+    def owner(self):
+        if self.edges[PLAYER1] and not self.edges[PLAYER2]:
+            return PLAYER1
+        elif self.edges[PLAYER2] and not self.edges[PLAYER1]:
+            return PLAYER2
+        return EMPTY
+
+    def copy(self):
+        region = Region(set(self.points))
+        region.edges = list(self.edges)
+        return region
+
 
 class Board:
 
@@ -20,11 +226,59 @@ class Board:
             owner = PLAYER1
         return owner
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, ko_depth=KO_BOARDS, track_territory=False):
         self.width = width
         self.height = height
-        self.cell = [[EMPTY for col in range (0, width)] for row in range(0, height)]
-        self.prev_cells = [None for i in range (0, KO_BOARDS)]
+        self.init_cells()
+        self.chains = {}
+        self.hash = 0
+        self.stone_count = [0, 0, 0]
+        # with track_territory, empty regions are kept up to date move by
+        # move and count_scores reads the tallies instead of flood filling
+        self.regions = None
+        self.territory = [0, 0, 0]
+        if track_territory:
+            self.rebuild_regions()
+        # empty points each colour can play without suicide, refreshed
+        # lazily from the points in dirty, and the chains left in atari
+        self.playable = {PLAYER1: set(), PLAYER2: set()}
+        self.atari = {PLAYER1: set(), PLAYER2: set()}
+        self.dirty = set(self.points)
+        # the point a simple ko forbids to ko_player, set by place_move
+        self.ko_point = None
+        self.ko_player = EMPTY
+        self.ko_marks = []
+        # one entry per play(), so undo() can take the move back
+        self.undo_log = []
+        # hashes of previous positions, oldest first, and how often each occurs
+        self.ko_depth = ko_depth
+        self.history = deque()
+        self.history_counts = {}
+
+    def init_cells(self):
+        """ Set up the cell storage and the point tables for this board size
+
+        Points are the keys used by chains, neighbours and zobrist; on
+        Board they are (row, col) tuples.
+        """
+        self.cell = [[EMPTY for col in range (0, self.width)] for row in range(0, self.height)]
+        self.neighbours = neighbour_table(self.width, self.height)
+        self.points = list(self.neighbours)
+        self.adjacent = adjacent_table(self.width, self.height)
+        self.zobrist = zobrist_table(self.width, self.height)
+        self.ring = ring_table(self.width, self.height)
+
+    def _point(self, row, col):
+        return (row, col)
+
+    def _coords(self, point):
+        return point
+
+    def _get(self, point):
+        return self.cell[point[0]][point[1]]
+
+    def _set(self, point, value):
+        self.cell[point[0]][point[1]] = value
 
     def int_to_cell(self, i):
         if i == 0:
@@ -48,6 +302,70 @@ class Board:
                 row +=1
             self.cell[row][col] = self.int_to_cell(int(cell))
             col += 1
+        self.rebuild_chains()
+
+    def rebuild_chains(self):
+        """ Recreate all chains from the cells
+
+        Needed only when the cells were written directly rather than
+        through place_move.
+        """
+        tracking = self.regions is not None
+        self.regions = None
+        self.chains = {}
+        self.hash = 0
+        self.stone_count = [0, 0, 0]
+        self.atari = {PLAYER1: set(), PLAYER2: set()}
+        self.dirty = set(self.points)
+        for point in self.points:
+            cell = self._get(point)
+            if cell == PLAYER1 or cell == PLAYER2:
+                self._set(point, EMPTY)
+                self._add_stone(cell, point)
+        if tracking:
+            self.rebuild_regions()
+
+    def rebuild_regions(self):
+        self.regions = {}
+        self.territory = [0, 0, 0]
+        for point in self.points:
+            if point not in self.chains and point not in self.regions:
+                self._new_region(self._flood_empty(point))
+
+    def copy_cells(self, other):
+        self.cell = [list(row) for row in other.cell]
+
+    def copy(self):
+        board = self.__class__(self.width, self.height, self.ko_depth)
+        board.copy_cells(self)
+        copies = {}
+        for (point, chain) in self.chains.items():
+            dup = copies.get(chain)
+            if dup is None:
+                dup = chain.copy()
+                copies[chain] = dup
+            board.chains[point] = dup
+        if self.regions is not None:
+            board.regions = {}
+            for (point, region) in self.regions.items():
+                dup = copies.get(region)
+                if dup is None:
+                    dup = region.copy()
+                    copies[region] = dup
+                board.regions[point] = dup
+        board.territory = list(self.territory)
+        board.stone_count = list(self.stone_count)
+        board.hash = self.hash
+        board.playable = {PLAYER1: set(self.playable[PLAYER1]), PLAYER2: set(self.playable[PLAYER2])}
+        board.atari = {PLAYER1: set([copies[chain] for chain in self.atari[PLAYER1]]),
+                       PLAYER2: set([copies[chain] for chain in self.atari[PLAYER2]])}
+        board.dirty = set(self.dirty)
+        board.ko_point = self.ko_point
+        board.ko_player = self.ko_player
+        board.undo_log = list(self.undo_log)
+        board.history = deque(self.history)
+        board.history_counts = dict(self.history_counts)
+        return board
 
     def valid_step(self, offset, target):
         ro, co = offset
@@ -60,29 +378,45 @@ class Board:
         return (valid, (tr, tc))
 
     def get_adjacent(self, row, col):
-        return [self.valid_step((r, c), (row, col)) for (r, c) in ADJACENT]
+        return self.adjacent[(row, col)]
+
+    def get_chain(self, row, col):
+        return self.chains.get(self._point(row, col))
+
+    def count_liberties(self, row, col):
+        chain = self.chains.get(self._point(row, col))
+        if chain is None:
+            return 0
+        return len(chain.liberties)
+
+    def in_atari(self, row, col):
+        return self.count_liberties(row, col) == 1
 
     def not_suicide(self, player, row, col):
-        dfs = DepthFirstSearch(self)
-        dfs.flood_fill_default(player, row, col)
-        if EMPTY in dfs.reached:
-            return True
-        else:
-            return self.is_capture(player, row, col)
+        return self._not_suicide(player, self._point(row, col))
+
+    def _not_suicide(self, player, point):
+        for point in self.neighbours[point]:
+            chain = self.chains.get(point)
+            if chain is None:
+                return True
+            elif chain.color == player:
+                # the chain keeps a liberty other than (row, col)
+                if len(chain.liberties) > 1:
+                    return True
+            elif len(chain.liberties) == 1:
+                return True
+        return False
 
     def is_capture(self, player, row, col):
-        dfs = DepthFirstSearch(self)
-        is_cap = False
-        prev_color = self.cell[row][col]
-        self.cell[row][col] = player
-        for (valid, (ar, ac)) in self.get_adjacent(row, col):
-            if valid and self.cell[row][col] != self.cell[ar][ac] and self.cell[ar][ac] != EMPTY:
-                dfs.refresh()
-                dfs.flood_fill(ar, ac)
-                if EMPTY not in dfs.reached:
-                    is_cap = True
-        self.cell[row][col] = prev_color
-        return is_cap
+        return self._is_capture(player, self._point(row, col))
+
+    def _is_capture(self, player, point):
+        for point in self.neighbours[point]:
+            chain = self.chains.get(point)
+            if chain is not None and chain.color != player and len(chain.liberties) == 1:
+                return True
+        return False
 
     def cells_match(self, c2):
         c1 = self.cell
@@ -101,79 +435,393 @@ class Board:
             except: result = False
             return result
 
-    def remove_pieces(self, to_remove):
-        for (row, col) in to_remove:
-            self.cell[row][col] = EMPTY
-            
+    def _merge(self, chain, other):
+        if len(chain.stones) < len(other.stones):
+            chain, other = other, chain
+        for point in other.stones:
+            self.chains[point] = chain
+        chain.stones |= other.stones
+        chain.liberties |= other.liberties
+        return chain
+
+    def _liberties_changed(self, chain, before):
+        """ Keep atari and dirty up to date after chain's liberties changed
+
+        Whether a neighbouring empty point is playable only depends on
+        whether the chain has exactly one liberty.
+        """
+        after = len(chain.liberties)
+        if after == 1:
+            self.atari[chain.color].add(chain)
+        else:
+            self.atari[chain.color].discard(chain)
+        if (before == 1) != (after == 1):
+            self.dirty |= chain.liberties
+
+    def _add_stone(self, owner, point):
+        self._set(point, owner)
+        self.hash ^= self.zobrist[point][owner]
+        self.dirty.add(point)
+        chain = Chain(owner, point)
+        self.chains[point] = chain
+        merged = False
+        tight = False
+        for adj in self.neighbours[point]:
+            other = self.chains.get(adj)
+            if other is None:
+                chain.liberties.add(adj)
+                self.dirty.add(adj)
+            elif other.color == owner:
+                if other is not chain:
+                    if len(other.liberties) == 1:
+                        tight = True
+                    self.atari[owner].discard(other)
+                    self.atari[owner].discard(chain)
+                    chain = self._merge(chain, other)
+                    merged = True
+            elif point in other.liberties:
+                other.liberties.remove(point)
+                self._liberties_changed(other, len(other.liberties) + 1)
+        chain.liberties.discard(point)
+        if len(chain.liberties) == 1:
+            self.atari[owner].add(chain)
+        if merged and (tight or len(chain.liberties) == 1):
+            self.dirty |= chain.liberties
+        self.stone_count[owner] += 1
+        if self.regions is not None:
+            self._region_filled(owner, point)
+        return chain
+
+    def _remove_chain(self, chain):
+        self.atari[chain.color].discard(chain)
+        for point in chain.stones:
+            self._set(point, EMPTY)
+            self.hash ^= self.zobrist[point][chain.color]
+            del self.chains[point]
+        self.dirty |= chain.stones
+        gained = {}
+        for point in chain.stones:
+            for adj in self.neighbours[point]:
+                other = self.chains.get(adj)
+                if other is not None and point not in other.liberties:
+                    if other not in gained:
+                        gained[other] = len(other.liberties)
+                    other.liberties.add(point)
+        for (other, before) in gained.items():
+            self._liberties_changed(other, before)
+        self.stone_count[chain.color] -= len(chain.stones)
+        if self.regions is not None:
+            self._region_emptied(chain.color, chain.stones)
+
+    def _remove_stone(self, point):
+        """ Take a single stone off the board, splitting its chain if needed """
+        chain = self.chains[point]
+        color = chain.color
+        self.atari[color].discard(chain)
+        self._set(point, EMPTY)
+        self.hash ^= self.zobrist[point][color]
+        del self.chains[point]
+        self.stone_count[color] -= 1
+        self.dirty.add(point)
+        gained = {}
+        for adj in self.neighbours[point]:
+            other = self.chains.get(adj)
+            if other is None:
+                self.dirty.add(adj)
+            elif other.color != color and point not in other.liberties:
+                gained[other] = len(other.liberties)
+                other.liberties.add(point)
+        rest = chain.stones
+        rest.discard(point)
+        for start in self.neighbours[point]:
+            if start in rest and self.chains[start] is chain:
+                piece = Chain(color, start)
+                stack = [start]
+                while stack:
+                    stone = stack.pop()
+                    self.chains[stone] = piece
+                    for adj in self.neighbours[stone]:
+                        if adj in rest:
+                            if adj not in piece.stones:
+                                piece.stones.add(adj)
+                                stack.append(adj)
+                        elif adj not in self.chains:
+                            piece.liberties.add(adj)
+                if len(piece.liberties) == 1:
+                    self.atari[color].add(piece)
+                self.dirty |= piece.liberties
+        for (other, before) in gained.items():
+            self._liberties_changed(other, before)
+        if self.regions is not None:
+            self._region_emptied(color, [point])
+
+    def _flood_empty(self, start):
+        """ The empty points connected to start """
+        area = set([start])
+        stack = [start]
+        while stack:
+            point = stack.pop()
+            for adj in self.neighbours[point]:
+                if adj not in area and adj not in self.chains:
+                    area.add(adj)
+                    stack.append(adj)
+        return area
+
+    def _claim(self, region, sign):
+        owner = region.owner()
+        if owner != EMPTY:
+            self.territory[owner] += sign * len(region.points)
+
+    def _new_region(self, points):
+        region = Region(points)
+        for point in points:
+            self.regions[point] = region
+            for adj in self.neighbours[point]:
+                chain = self.chains.get(adj)
+                if chain is not None:
+                    region.edges[chain.color] += 1
+        self._claim(region, 1)
+        return region
+
+    def _locally_connected(self, point):
+        """ Whether the empty neighbours of point touch each other around it
+
+        If they do, filling point can't split its region. Each pair of
+        neighbours is joined through the diagonal point between them.
+        """
+        empty = [around is not None and around in self.regions for around in self.ring[point]]
+        runs = 0
+        for i in (0, 2, 4, 6):
+            if empty[i] and not (empty[i - 2] and empty[i - 1]):
+                runs += 1
+        return runs <= 1
+
+    def _region_filled(self, owner, point):
+        region = self.regions.pop(point)
+        self._claim(region, -1)
+        region.points.remove(point)
+        empties = []
+        for adj in self.neighbours[point]:
+            chain = self.chains.get(adj)
+            if chain is None:
+                empties.append(adj)
+            else:
+                region.edges[chain.color] -= 1
+        region.edges[owner] += len(empties)
+        if len(empties) < 2 or self._locally_connected(point):
+            self._claim(region, 1)
+            return
+        pieces = []
+        for start in empties:
+            if not any(start in piece for piece in pieces):
+                piece = self._flood_empty(start)
+                if len(piece) == len(region.points):
+                    self._claim(region, 1)
+                    return
+                pieces.append(piece)
+        for piece in pieces:
+            self._new_region(piece)
+
+    def _region_emptied(self, color, points):
+        regions = []
+        for point in points:
+            for adj in self.neighbours[point]:
+                region = self.regions.get(adj)
+                if region is not None:
+                    if region not in regions:
+                        self._claim(region, -1)
+                        regions.append(region)
+                    region.edges[color] -= 1
+        if not regions:
+            self._new_region(set(points))
+            return
+        # merge everything into the largest neighbouring region
+        regions.sort(key=lambda region: len(region.points), reverse=True)
+        region = regions[0]
+        for other in regions[1:]:
+            for point in other.points:
+                self.regions[point] = region
+            region.points |= other.points
+            region.edges[PLAYER1] += other.edges[PLAYER1]
+            region.edges[PLAYER2] += other.edges[PLAYER2]
+        for point in points:
+            region.points.add(point)
+            self.regions[point] = region
+            for adj in self.neighbours[point]:
+                chain = self.chains.get(adj)
+                if chain is not None:
+                    region.edges[chain.color] += 1
+        self._claim(region, 1)
+
     def place_move(self, owner, row, col):
-        self.cell[row][col] = owner
-        dfs = DepthFirstSearch(self)
-        is_cap = False
-        to_remove = []
-        for (valid, (ar, ac)) in self.get_adjacent(row, col):
-            if valid and not self.cell[row][col] == self.cell[ar][ac] and not self.cell[ar][ac] == EMPTY:
-                dfs.refresh()
-                dfs.flood_fill(ar, ac)
-                if EMPTY not in dfs.reached:
-                    to_remove = to_remove + dfs.matched
-        self.remove_pieces(to_remove)
+        """ Place a stone and remove the groups it captures
+
+        Returns the (row, col) of every captured stone.
+        """
+        point = self._point(row, col)
+        placed = self._add_stone(owner, point)
+        captured = []
+        ko_point = None
+        for adj in self.neighbours[point]:
+            chain = self.chains.get(adj)
+            if chain is not None and chain.color != owner and not chain.liberties:
+                captured.extend([self._coords(stone) for stone in chain.stones])
+                ko_point = chain.rep
+                self._remove_chain(chain)
+        # a lone stone that took a lone stone and has only that point as liberty
+        if len(captured) == 1 and len(placed.stones) == 1 and len(placed.liberties) == 1:
+            self.ko_point = ko_point
+            self.ko_player = PLAYER1 + PLAYER2 - owner
+        else:
+            self.ko_point = None
+            self.ko_player = EMPTY
+        return captured
+
+    def play(self, owner, row, col):
+        """ place_move and push_state, remembering enough to undo() them
+
+        Lets search code try a move in place instead of copying the board.
+        Returns the (row, col) of every captured stone.
+        """
+        point = self._point(row, col)
+        entry = (point, owner, self.hash, self.ko_point, self.ko_player)
+        captured = self.place_move(owner, row, col)
+        evicted = None
+        if self.ko_depth is not None and len(self.history) >= self.ko_depth:
+            evicted = self.history[0]
+        self.push_state()
+        self.undo_log.append(entry + ([self._point(r, c) for (r, c) in captured], evicted))
+        return captured
+
+    def undo(self):
+        """ Take back the last play() """
+        (point, owner, prev_hash, ko_point, ko_player, captured, evicted) = self.undo_log.pop()
+        self._pop_state()
+        if evicted is not None:
+            self.history.appendleft(evicted)
+            self.history_counts[evicted] = self.history_counts.get(evicted, 0) + 1
+        self._remove_stone(point)
+        for stone in captured:
+            self._add_stone(PLAYER1 + PLAYER2 - owner, stone)
+        self.hash = prev_hash
+        self.ko_point = ko_point
+        self.ko_player = ko_player
 
     def count_scores(self):
-        already_counted = []
-        scores = [0,0]
-        dfs = DepthFirstSearch(self)
-        for ir, row in enumerate(self.cell):
-            for ic, cell in enumerate(row):
-                if cell == 0 and (ir, ic) not in already_counted:
-                    dfs.flood_fill(ir, ic)
-                    already_counted += dfs.matched
-                    if len(dfs.reached) == 1:
-                        if dfs.reached[0] == 1:
-                            scores[0] += len(dfs.matched)
-                        elif dfs.reached[0] == 2:
-                            scores[1] += len(dfs.matched)
-                    dfs.refresh()
-                elif cell == 1:
-                    scores[0] += 1
-                elif cell == 2:
-                    scores[1] += 1
+        """ Area scores: stones plus surrounded empty regions, KOMI to PLAYER2 """
+        if self.regions is not None:
+            scores = [self.stone_count[PLAYER1] + self.territory[PLAYER1],
+                      self.stone_count[PLAYER2] + self.territory[PLAYER2]]
+        else:
+            scores = [self.stone_count[PLAYER1], self.stone_count[PLAYER2]]
+            counted = set()
+            for point in self.points:
+                if point not in self.chains and point not in counted:
+                    area = self._flood_empty(point)
+                    counted |= area
+                    reached = set()
+                    for empty in area:
+                        for adj in self.neighbours[empty]:
+                            chain = self.chains.get(adj)
+                            if chain is not None:
+                                reached.add(chain.color)
+                    if len(reached) == 1:
+                        scores[reached.pop() - 1] += len(area)
         scores[1] += KOMI
-        print("scores = " + str(scores))
         return scores
-                
+
+    def hash_after(self, player, row, col):
+        """ Zobrist hash of the position after player places at (row, col) """
+        return self._hash_after(player, self._point(row, col))
+
+    def _hash_after(self, player, point):
+        result = self.hash ^ self.zobrist[point][player]
+        captured = []
+        for adj in self.neighbours[point]:
+            chain = self.chains.get(adj)
+            if (chain is not None and chain.color != player and len(chain.liberties) == 1
+                    and chain not in captured):
+                captured.append(chain)
+                for stone in chain.stones:
+                    result ^= self.zobrist[stone][chain.color]
+        return result
 
     def not_ko(self, player, row, col):
-        if self.is_capture(player, row, col):
-            tcell = copy.deepcopy(self.cell)
-            tboard = Board(self.width, self.height)
-            tboard.cell = tcell
-            tboard.place_move(player, row, col)
-            ko = False
-            for pboard in self.prev_cells:
-                if tboard.cells_match (pboard):
-                    ko = True
-            return not ko
+        return self._not_ko(player, self._point(row, col))
+
+    def _not_ko(self, player, point):
+        if self._is_capture(player, point):
+            return self._hash_after(player, point) not in self.history_counts
         else: return True
 
+    def is_legal(self, player, row, col):
+        """ Check one move, looking only at its neighbours and the ko history """
+        if row < 0 or row >= self.height or col < 0 or col >= self.width:
+            return False
+        return self._is_legal(player, self._point(row, col))
+
+    def _is_legal(self, player, point):
+        return self._get(point) == EMPTY and self._not_suicide(player, point) and self._not_ko(player, point)
+
+    def refresh_playable(self):
+        """ Recheck the points whose neighbourhood changed since the last call """
+        for point in self.dirty:
+            for player in (PLAYER1, PLAYER2):
+                if point not in self.chains and self._not_suicide(player, point):
+                    self.playable[player].add(point)
+                else:
+                    self.playable[player].discard(point)
+        self.dirty = set()
+
+    def _ko_points(self, player):
+        """ Points player may not play because of ko
+
+        Under simple ko the only candidate is the point left by the last
+        capture. Otherwise only captures can repeat a position, so the
+        candidates are the last liberties of the opponent's chains in
+        atari. Either way each candidate costs one hash lookup.
+        """
+        if self.ko_depth is not None and self.ko_depth <= SIMPLE_KO_BOARDS:
+            candidates = []
+            if self.ko_point is not None and self.ko_player == player:
+                candidates.append(self.ko_point)
+        else:
+            candidates = [point for chain in self.atari[PLAYER1 + PLAYER2 - player]
+                for point in chain.liberties]
+        ko_points = set()
+        for point in candidates:
+            if not self._not_ko(player, point):
+                ko_points.add(point)
+        return ko_points
+
     def legal_moves(self, player):
-        legal = []
-        for (ri, row) in enumerate(self.cell):
-            for (ci, cell) in enumerate(row):
-                if cell == EMPTY and self.not_suicide(player, ri, ci) and self.not_ko(player, ri, ci):
-                    legal.append((ri, ci))
-        return legal
+        """ All legal moves for player, from the incrementally kept playable set """
+        self.refresh_playable()
+        ko_points = self._ko_points(player)
+        return [self._coords(point) for point in sorted(self.playable[player])
+            if point not in ko_points]
 
     def collapse_array(self):
         return [cell for row in self.cell for cell in row]
         
 
     def push_state(self):
-        limit = len(self.prev_cells) - 1
-        for count in range(0, limit):
-            index = limit - count
-            self.prev_cells[index] = self.prev_cells[index - 1]
-        self.prev_cells[0] = copy.deepcopy(self.cell)
-            
+        self.history.append(self.hash)
+        self.history_counts[self.hash] = self.history_counts.get(self.hash, 0) + 1
+        if self.ko_depth is not None and len(self.history) > self.ko_depth:
+            old = self.history.popleft()
+            if self.history_counts[old] == 1:
+                del self.history_counts[old]
+            else:
+                self.history_counts[old] -= 1
+
+    def _pop_state(self):
+        last = self.history.pop()
+        if self.history_counts[last] == 1:
+            del self.history_counts[last]
+        else:
+            self.history_counts[last] -= 1
+
     def board_symbol(self, cell):
         if cell == EMPTY:
             return "."
@@ -212,24 +860,122 @@ class Board:
 
     def mark_ko(self, player):
         owner = self.get_owner(player)
-        ko_cells = []
-        for (ir, row) in enumerate(self.cell):
-            for (ic, cell) in enumerate(row):
-                if cell == EMPTY and not self.not_ko(owner, ir, ic):
-                    ko_cells.append((ir, ic))
-        for (row, col) in ko_cells:
-            self.cell[row][col] = KO
+        self.ko_marks = list(self._ko_points(owner))
+        for point in self.ko_marks:
+            self._set(point, KO)
 
     def unmark_ko(self):
-        for (ir, row) in enumerate(self.cell):
-            for (ic, col) in enumerate(row):
-                if self.cell[ir][ic] == KO:
-                    self.cell[ir][ic] = EMPTY
+        for point in self.ko_marks:
+            if self._get(point) == KO:
+                self._set(point, EMPTY)
+        self.ko_marks = []
 
 
 # End of Board class
 
 
+CSV_VALUES = {EMPTY: "0", PLAYER1: "1", PLAYER2: "2", KO: "-1"}
+
+
+class FlatRow:
+    """ One row of a FlatBoard, indexed by column """
+
+    def __init__(self, data, start, width):
+        self.data = data
+        self.start = start
+        self.width = width
+
+    def __len__(self):
+        return self.width
+
+    def __iter__(self):
+        return iter(self.data[self.start:self.start + self.width])
+
+    def __getitem__(self, col):
+        if col < 0 or col >= self.width:
+            raise IndexError(col)
+        return self.data[self.start + col]
+
+    def __setitem__(self, col, value):
+        if col < 0 or col >= self.width:
+            raise IndexError(col)
+        self.data[self.start + col] = value
+
+
+class FlatRows:
+    """ A FlatBoard seen as board.cell[row][col] """
+
+    def __init__(self, board):
+        self.board = board
+
+    def __len__(self):
+        return self.board.height
+
+    def __iter__(self):
+        for row in range(0, self.board.height):
+            yield self[row]
+
+    def __getitem__(self, row):
+        board = self.board
+        if row < 0 or row >= board.height:
+            raise IndexError(row)
+        return FlatRow(board.data, (row + 1) * board.stride + 1, board.width)
+
+
+class FlatBoard(Board):
+    """ Board stored in one flat array('b') with a BORDER frame around it
+
+    Points are indices into the padded array, and the neighbour and
+    zobrist tables are plain lists shared by every board of the same
+    size, so moves allocate far less than on Board and copying the
+    cells is a single buffer copy. cell is a row view onto the same
+    buffer, so code written against Board.cell, DepthFirstSearch
+    included, runs unchanged.
+    """
+
+    def init_cells(self):
+        (self.stride, self.points, self.neighbours, blank, self.zobrist, self.ring) = \
+            flat_tables(self.width, self.height)
+        self.data = blank[:]
+        self.adjacent = adjacent_table(self.width, self.height)
+
+    @property
+    def cell(self):
+        return FlatRows(self)
+
+    def _point(self, row, col):
+        return (row + 1) * self.stride + col + 1
+
+    def _coords(self, point):
+        row, col = divmod(point, self.stride)
+        return (row - 1, col - 1)
+
+    def _get(self, point):
+        return self.data[point]
+
+    def _set(self, point, value):
+        self.data[point] = value
+
+    def copy_cells(self, other):
+        self.data = other.data[:]
+
+    def parse(self, data):
+        data_cells = self.data
+        for (point, cell) in zip(self.points, data.split(',')):
+            data_cells[point] = self.int_to_cell(int(cell))
+        self.rebuild_chains()
+
+    def collapse_array(self):
+        data = self.data
+        return [data[point] for point in self.points]
+
+    def to_csv(self):
+        data = self.data
+        return ",".join([CSV_VALUES.get(data[point], "0") for point in self.points])
+
+# End of FlatBoard class
+
+
 class DepthFirstSearch:
 
     def __init__(self, board):
@@ -239,19 +985,26 @@ class DepthFirstSearch:
         self.matched = []
 
     def search_step(self, fillval, loc):
-        row, col = loc
-        if not self.visited[row][col]:
-            self.visited[row][col] = True
-            if self.board.cell[row][col] == fillval:
-                self.matched.append((row, col))
-                adjacents = self.board.get_adjacent(row, col)
-                for (valid, target) in adjacents:
-                    if valid:
-                        self.search_step (fillval, target)
-            else:
-                reached = self.board.cell[row][col]
-                if reached not in self.reached:
-                    self.reached.append(reached)
+        """ Visit the points connected to loc through cells equal to fillval
+
+        Uses an explicit stack rather than recursion, so long or winding
+        chains on big boards can't hit the recursion limit.
+        """
+        stack = [loc]
+        while stack:
+            row, col = stack.pop()
+            if not self.visited[row][col]:
+                self.visited[row][col] = True
+                if self.board.cell[row][col] == fillval:
+                    self.matched.append((row, col))
+                    adjacents = self.board.get_adjacent(row, col)
+                    for (valid, target) in reversed(adjacents):
+                        if valid:
+                            stack.append(target)
+                else:
+                    reached = self.board.cell[row][col]
+                    if reached not in self.reached:
+                        self.reached.append(reached)
 
     def flood_fill(self, row, col):
         fillval = self.board.cell[row][col]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+""" Warm bots: bot processes kept running from one game to the next
+
+A bot that loads a large model or opening book can spend longer
+starting than playing a short game. Given a BotPool as its bot_pool
+option, engine.run_game leases its bots from the pool instead of
+starting them, and gives them back when the game is over. A bot that
+saw the game out is then reset for the next one:
+
+    engine:  new game
+    bot:     ready
+
+The bot has already been sent the end of the old game, and after ready
+it is sent the settings of the new one as if it had just started, so
+everything from the old game should be forgotten then. Lines the bot
+writes before ready, such as its answer to the end state's action move,
+are dropped. Bots have to opt in to this, as one that never says ready
+is killed after reset_timeout seconds; starter/python does.
+
+A bot is started fresh instead of being reset when it crashed, timed
+out or made an invalid move in the game, when the game ended with an
+error, when it died waiting in the pool, and after max_games games, so
+a slow leak in a bot can't grow without end.
+"""
+import time
+
+from sandbox import get_sandbox
+
+NEW_GAME = 'new game\n'
+READY = 'ready'
+
+class BotPool:
+    """ Idle bots by (working directory, command, secure), and the leased ones """
+
+    def __init__(self, max_games=100, reset_timeout=5.0):
+        self.max_games = max_games
+        self.reset_timeout = reset_timeout
+        self.idle = {}
+        self.leased = {}
+        self.started = 0
+        self.reused = 0
+
+    def lease(self, working_directory, shell_command, secure=None, verbose=None):
+        """ A started sandbox for the command, warm when there's one idle """
+        key = (working_directory, shell_command, secure)
+        idle = self.idle.get(key, [])
+        while idle:
+            (sandbox, games) = idle.pop()
+            if sandbox.is_alive:
+                self.leased[sandbox] = (key, games)
+                self.reused += 1
+                return sandbox
+            # crashed while it waited
+            self._discard(sandbox)
+        sandbox = get_sandbox(working_directory, secure=secure, verbose=verbose)
+        sandbox.start(shell_command)
+        self.leased[sandbox] = (key, 0)
+        self.started += 1
+        return sandbox
+
+    def give_back(self, sandbox, reusable):
+        """ Keep a leased sandbox for another game if it's reusable and resets """
+        (key, games) = self.leased.pop(sandbox)
+        games += 1
+        if reusable and games < self.max_games and self._reset(sandbox):
+            self.idle.setdefault(key, []).append((sandbox, games))
+        else:
+            self._discard(sandbox)
+
+    def _reset(self, sandbox):
+        """ True once the bot has answered new game, left paused for its next game """
+        sandbox.resume()
+        sandbox.write(NEW_GAME)
+        deadline = time.time() + self.reset_timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not sandbox.is_alive:
+                return False
+            line = sandbox.read_line(remaining)
+            if line is None:
+                # timed out, or stdout closed as the bot died
+                return False
+            if line.strip().lower() == READY:
+                break
+        # what it wrote to stderr in between belongs to no game
+        while sandbox.read_error() is not None:
+            pass
+        sandbox.pause()
+        return True
+
+    def _discard(self, sandbox):
+        if sandbox.is_alive:
+            sandbox.kill()
+        sandbox.release()
+
+    def close(self):
+        """ Kill every idle bot; leased ones are their game's to give back """
+        for idle in self.idle.values():
+            for (sandbox, games) in idle:
+                self._discard(sandbox)
+        self.idle = {}
+
+# End of BotPool class
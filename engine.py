@@ -7,12 +7,21 @@ import random
 import sys
 import json
 import io
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
 if sys.version_info >= (3,):
     def unicode(s):
         return s
 
 from sandbox import get_sandbox
 
+# seconds get_moves sleeps at most before checking the bots are alive
+LIVENESS_INTERVAL = 0.05
+# most lines get_moves takes from a bot in one turn
+MOVE_LINES = 40000
+
 class HeadTail(object):
     'Capture first part of file write and discard remainder'
     def __init__(self, file, max_capture=510):
@@ -62,8 +71,59 @@ def get_bots (bots, indices):
     return result
 
 def run_game(game, botcmds, options):
+    """ Play a game to the end with sandboxed bots, returning the game result """
+    bot_pool = options.get('bot_pool', None)
+    steps = play_game(game, botcmds, options)
+    request = next(steps)
+    while request[0] != 'done':
+        try:
+            if request[0] == 'start':
+                (bot_cwd, bot_cmd, secure, verbose) = request[1:]
+                if bot_pool:
+                    reply = bot_pool.lease(bot_cwd, bot_cmd, secure, verbose)
+                else:
+                    reply = get_sandbox(bot_cwd, secure=secure, verbose=verbose)
+                    reply.start(bot_cmd)
+            elif request[0] == 'stop':
+                (bot, reusable) = request[1:]
+                if bot_pool:
+                    bot_pool.give_back(bot, reusable)
+                else:
+                    if bot.is_alive:
+                        bot.kill()
+                    bot.release()
+                reply = None
+            elif request[0] == 'moves':
+                reply = get_moves(*request[1:])
+            elif request[0] == 'sleep':
+                time.sleep(request[1])
+                reply = None
+        except Exception:
+            request = steps.throw(*sys.exc_info())
+        else:
+            request = steps.send(reply)
+    return request[1]
+
+def play_game(game, botcmds, options):
+    """ The game loop of run_game, as a generator
+
+    Whatever has to wait is handed to the caller as a request, and the
+    caller sends back the answer, or throws in what went wrong:
+
+        ('start', cwd, command, secure, verbose_log)  a started sandbox
+        ('moves', <get_moves arguments>)              what get_moves returns
+        ('sleep', seconds)                            None once they're up
+        ('stop', sandbox, reusable)                   None once it's killed, or
+                                                      given back to the bot_pool
+
+    The last request is ('done', game_result). run_game answers them
+    in turn; async_engine.run_game answers them with coroutines, so one
+    process can play many games at once. reusable is True for the bots
+    that played the game out, which a bot_pool may keep for the next.
+    """
     # file descriptors for replay and streaming formats
     replay_log = options.get('replay_log', None)
+    replay_writer = options.get('replay_writer', None)
     stream_log = options.get('stream_log', None)
     verbose_log = options.get('verbose_log', None)
     # file descriptors for bots, should be list matching # of bots
@@ -82,6 +142,10 @@ def run_game(game, botcmds, options):
 
     location = options.get('location', 'localhost')
     game_id = options.get('game_id', 0)
+    playernames = options.get('playernames', None)
+    # when given a list, (turn, seconds, seconds spent in the bots) is
+    # appended to it for every turn played
+    turn_timings = options.get('turn_timings', None)
 
     ack_turn_zero = options.get('ack_turn_zero', True)
 
@@ -90,6 +154,8 @@ def run_game(game, botcmds, options):
     bots = []
     bot_status = []
     bot_turns = []
+    bot_time_used = []
+    start_time = time.time()
 
     fischer_time = False
     timebank_limit = 0
@@ -105,11 +171,11 @@ def run_game(game, botcmds, options):
         # create bot sandboxes
         for b, bot in enumerate(botcmds):
             bot_cwd, bot_cmd = bot
-            sandbox = get_sandbox(bot_cwd, secure=options.get('secure_jail', None), verbose=verbose_log)
-            sandbox.start(bot_cmd)
+            sandbox = yield ('start', bot_cwd, bot_cmd, options.get('secure_jail', None), verbose_log)
             bots.append(sandbox)
             bot_status.append('survived')
             bot_turns.append(0)
+            bot_time_used.append(0.0)
 
             # ensure it started
             if not sandbox.is_alive:
@@ -125,6 +191,15 @@ def run_game(game, botcmds, options):
         else:
             timebank = [0 for bot in bots]
 
+        if replay_writer:
+            replay_writer.header({
+                'challenge': game.__class__.__name__.lower(),
+                'location': location,
+                'game_id': game_id,
+                'playernames': playernames,
+                'replaydata': game.get_replay()
+            })
+
         if stream_log:
             stream_log.write(game.get_player_start())
             stream_log.flush()
@@ -132,8 +207,12 @@ def run_game(game, botcmds, options):
         if verbose_log:
             verbose_log.write('running for %s turns\n' % turns)
         for turn in range(turns+1):
+            turn_start = time.time()
             if turn == 0:
                 game.start_game()
+                if replay_writer:
+                    for data in game.get_replay_turns():
+                        replay_writer.turn(data, game.get_scores())
 
             bot_indices = game.bots_to_play(turn)
 #            bots_to_play = get_bots (bots, bot_indices)
@@ -199,13 +278,14 @@ def run_game(game, botcmds, options):
                     pnums, pbots = zip(*bot_list[group_num:group_num + simul_num])
                     if fischer_time: # Note that this assumes parallel bots and fischer time are not going to be combined. Some extra effort needed to change this.
                         group_timelimit = timebank[pnums[0]] / 1000
-                    moves, errors, status, times = get_moves(game, pbots, pnums, 
+                    moves, errors, status, times = yield ('moves', game, pbots, pnums,
                             bot_indices, group_timelimit, timebank, fischer_time, turn)
                     for p, b in enumerate(pnums):
                         bot_moves[b] = moves[p]
                         error_lines[b] = errors[p]
                         statuses[b] = status[p]
                         times_used[b] = times[p]
+                        bot_time_used[b] += times[p]
                 if fischer_time:
                     for i, time_used in enumerate(times_used):
                         timebank[i] -= time_used * 1000
@@ -256,6 +336,9 @@ def run_game(game, botcmds, options):
 
             if turn > 0:
                 game.finish_turn()
+                if replay_writer:
+                    for data in game.get_replay_turns():
+                        replay_writer.turn(data, game.get_scores())
 
             # send ending info to eliminated bots
             bots_eliminated = []
@@ -282,7 +365,7 @@ def run_game(game, botcmds, options):
             if bots_eliminated and end_wait:
                 if verbose_log:
                     verbose_log.write('waiting {0} seconds for bots to process end turn\n'.format(end_wait))
-                time.sleep(end_wait)
+                yield ('sleep', end_wait)
             for b in bots_eliminated:
                 bots[b].kill()
 
@@ -304,6 +387,9 @@ def run_game(game, botcmds, options):
                     verbose_log.write(' {0:^{1}}'.format(values, max(len(key), len(str(values)))))
                 verbose_log.write('\n')
 
+            if turn_timings is not None:
+                turn_timings.append((turn, time.time() - turn_start, sum(times_used)))
+
             if game.game_over():
                 break
 
@@ -344,11 +430,9 @@ def run_game(game, botcmds, options):
                 bot.resume()
             if verbose_log:
                 verbose_log.write('waiting {0} seconds for bots to process end turn\n'.format(end_wait))
-            time.sleep(end_wait)
-        for bot in bots:
-            if bot.is_alive:
-                bot.kill()
-            bot.release()
+            yield ('sleep', end_wait)
+        for b, bot in enumerate(bots):
+            yield ('stop', bot, not error and bot_status[b] == 'survived')
 
     if error:
         game_result = { 'error': error }
@@ -360,6 +444,8 @@ def run_game(game, botcmds, options):
             'game_id': game_id,
             'status': bot_status,
             'playerturns': bot_turns,
+            'playertime': [round(seconds, 3) for seconds in bot_time_used],
+            'duration': round(time.time() - start_time, 3),
             'score': scores,
             'rank': [sorted(scores, reverse=True).index(x) for x in scores],
             'replayformat': 'json',
@@ -377,10 +463,14 @@ def run_game(game, botcmds, options):
         if capture_errors:
             game_result['errors'] = [head.headtail() for head in error_logs]
 
+    if playernames:
+        game_result['playernames'] = playernames
     if replay_log:
         json.dump(game_result, replay_log, sort_keys=True)
+    if replay_writer:
+        replay_writer.trailer(game_result)
 
-    return game_result
+    yield ('done', game_result)
 
 def get_moves(game, bots, bot_nums, bots_to_play, time_limit, timebank, fischer_time, turn):
     bot_finished = [not game.is_alive(bot_nums[b]) for b in range(len(bots))]
@@ -389,6 +479,12 @@ def get_moves(game, bots, bot_nums, bots_to_play, time_limit, timebank, fischer_
     statuses = [None for b in bots]
     time_used = [0 for b in bots]
 
+    # the sandboxes put themselves on ready whenever they have a new
+    # line, so waiting for output blocks instead of polling; set before
+    # the first read so no line can arrive unnoticed
+    ready = Queue()
+    for bot in bots:
+        bot.notify = ready
 
     # resume all bots
     for bot in bots:
@@ -402,7 +498,8 @@ def get_moves(game, bots, bot_nums, bots_to_play, time_limit, timebank, fischer_
     #   or when time is up
     while (sum(bot_finished) < len(bot_finished) and
             time.time() - start_time < time_limit):
-#        time.sleep(0.01) # Why is this here?
+        # set when a bot has more lines queued than one pass reads
+        more = False
         for b, bot in enumerate(bots):
             if bot_nums[b] not in bots_to_play:
                 if not bot_finished[b]:
@@ -439,12 +536,34 @@ def get_moves(game, bots, bot_nums, bots_to_play, time_limit, timebank, fischer_
                     # bot finished sending data for this turn
                     break
                 #print(line)
+            else:
+                more = True
 
             for x in range(100):
                 line = bot.read_error()
                 if line is None:
                     break
                 error_lines[b].append(line)
+            else:
+                more = True
+
+        if not more and sum(bot_finished) < len(bot_finished):
+            # sleep until a bot has output or the turn is up; a bot that
+            # dies without a word is only seen by is_alive, so look again
+            # every LIVENESS_INTERVAL
+            remaining = time_limit - (time.time() - start_time)
+            if remaining > 0:
+                try:
+                    ready.get(timeout=min(remaining, LIVENESS_INTERVAL))
+                except Empty:
+                    pass
+                # every bot is read on the next pass anyway
+                while not ready.empty():
+                    ready.get()
+
+    for bot in bots:
+        bot.notify = None
+
     # pause all bots again
     for bot in bots:
         if bot.is_alive:
@@ -469,7 +588,7 @@ def get_moves(game, bots, bot_nums, bots_to_play, time_limit, timebank, fischer_
             continue # bot is dead
 
         line = bot.read_line()
-        while line is not None and len(bot_moves[b]) < 40000:
+        while line is not None and len(bot_moves[b]) < MOVE_LINES:
             line = line.strip()
 #            if line.lower() == 'go':
             if game.bot_input_finished(line):
@@ -75,5 +75,9 @@ class Game:
     def get_replay(self):
         pass
 
+    # used for streaming the replay, returns the turns recorded since the last call
+    def get_replay_turns(self):
+        return []
+
     def bot_input_finished(self, line):
         return line.lower() == 'go'
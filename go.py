@@ -9,12 +9,28 @@ import operator
 from game import Game
 from copy import deepcopy
 import board
+from replay import ReplayRecorder, KEYFRAME_TURNS, REVISION as REPLAY_REVISION
 
 try:
     from sys import maxint
 except ImportError:
     from sys import maxsize as maxint
 
+# Largest field side the engine supports; fields needn't be square
+MAX_FIELD_SIZE = 49
+# Bots taking field deltas still get the whole field this often
+FIELD_KEYFRAME_TURNS = 20
+
+def ko_indices(cells):
+    """ Indices of the KO marks in a list of cell values """
+    indices = []
+    index = -1
+    while True:
+        try:
+            index = cells.index(board.KO, index + 1)
+        except ValueError:
+            return indices
+        indices.append(index)
 
 class Go(Game):
     def __init__(self, options=None):
@@ -32,6 +48,15 @@ class Go(Game):
             randint(-maxint-1, maxint))
         self.field_width = options.get('field_width',19)
         self.field_height = options.get('field_height',19)
+        if not (0 < self.field_width <= MAX_FIELD_SIZE and 0 < self.field_height <= MAX_FIELD_SIZE):
+            raise ValueError("field size {0}x{1} is outside 1x1 to {2}x{2}"
+                             .format(self.field_width, self.field_height, MAX_FIELD_SIZE))
+        # printing the board after every move costs time proportional to its area
+        self.print_board = options.get('print_board', True)
+        # number of previous positions checked for ko, None for positional superko
+        self.ko_depth = options.get('ko_depth', board.KO_BOARDS)
+        # a rules backend as described in rules.py
+        self.board_class = options.get('board_class', board.Board)
 
         seed(self.engine_seed)
 #        self.field = [ EMPTY for j in range(0, self.field_width * self.field_height) ]
@@ -51,7 +76,25 @@ class Go(Game):
 
         self.consecutive_passes = 0
         #self.field = board.Board(self.field_width, self.field_height)
-        self.board = board.Board(self.field_width, self.field_height)
+        self.board = self.board_class(self.field_width, self.field_height, self.ko_depth,
+                                      track_territory=True)
+        # bumped whenever the position changes; rendered fields and scores
+        # are cached against it so each is computed once per position
+        self.board_version = 0
+        self.cache_version = 0
+        self.cache = {}
+        # bots that sent 'settings field_updates delta' get only the cells
+        # changed since the field they last saw, which is kept with its
+        # checksum, its ko marks and the points moves have changed since
+        self.delta_updates = [False] * 2
+        self.sent_cells = [None] * 2
+        self.sent_checksum = [0] * 2
+        self.sent_ko = [set(), set()]
+        self.keyframe_turn = [0] * 2
+        self.changed_points = [set(), set()]
+        # bots that sent 'settings field_encoding packed' get whole fields
+        # as board.encode_field strings instead of CSV
+        self.packed_fields = [False] * 2
 
         # initialize scores
         self.score = [0]*self.num_players
@@ -73,7 +116,19 @@ class Go(Game):
         self.orders = [[] for i in range(self.num_players)]
 
         ### collect turns for the replay
+        # revision 1 keeps every turn's state changes, revision 2 only the
+        # moves and a keyframe now and then, see replay.py
+        self.replay_revision = options.get('replay_revision', 1)
         self.replay_data = []
+        self.recorder = ReplayRecorder(options.get('keyframe_turns', KEYFRAME_TURNS))
+        # with stream_replay turns are handed to the engine by
+        # get_replay_turns as they're played instead of kept until the end
+        self.stream_replay = options.get('stream_replay', False)
+        # and then only kept as well when the whole replay is also wanted
+        # at the end, as with playgame --log_replay
+        self.keep_replay = options.get('keep_replay', not self.stream_replay)
+        self.pending_turns = []
+        self.turn_move = []
 
     def output_cell (self, cell):
         return str(cell)
@@ -88,6 +143,8 @@ class Go(Game):
         visible_updates = []
         # next list all transient objects
         for update in updates:
+            if update[0] == 'update game field':
+                update = self.field_update(player)
             visible_updates.append(update)
         visible_updates.append([]) # newline
         return '\n'.join(' '.join(map(str,s)) for s in visible_updates)
@@ -108,9 +165,7 @@ class Go(Game):
         changes = []
         changes.extend([['update game round', int(self.turn / 2)]])
         changes.extend([['update game move', self.turn]])
-        self.board.mark_ko(player)
-        changes.extend([['update game field', self.board.to_csv()]])
-        self.board.unmark_ko()
+        changes.extend([['update game field', self.cached(('field', player), lambda: self.render_field(player))]])
         if self.last_move:
             row, col = self.last_move
             changes.extend([['update ' + self.use_player_names[self.other_player(player)] + ' last_move place_move', col, row]])
@@ -118,6 +173,68 @@ class Go(Game):
             changes.extend([['update ' + self.use_player_names[self.other_player(player)] + ' last_move pass']])
         return changes
 
+    def cached(self, key, compute):
+        """ compute(), remembered under key until the board next changes """
+        if self.cache_version != self.board_version:
+            self.cache = {}
+            self.cache_version = self.board_version
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def render_field(self, player):
+        """ The field as sent to player, with the points ko forbids them marked """
+        self.board.mark_ko(player)
+        field = self.board.to_csv()
+        self.board.unmark_ko()
+        return field
+
+    def render_cells(self, player):
+        """ The field as sent to player, as a list of cell values """
+        self.board.mark_ko(player)
+        cells = self.board.collapse_array()
+        self.board.unmark_ko()
+        return cells
+
+    def full_field_update(self, player):
+        """ The whole field for player, packed if they asked for that """
+        if self.packed_fields[player]:
+            cells = self.cached(('cells', player), lambda: self.render_cells(player))
+            return ['update game field_packed', self.cached(('packed', player), lambda: board.encode_field(cells))]
+        return ['update game field', self.cached(('field', player), lambda: self.render_field(player))]
+
+    def field_update(self, player):
+        """ The field line for player: the whole field, or a delta if they asked for one
+
+            A delta is 'update game field_delta <checksum> <changes>', with
+            changes as col,row,value triples separated by ';' and the
+            checksum being board.field_checksum of the whole new field.
+        """
+        if not self.delta_updates[player]:
+            return self.full_field_update(player)
+        cells = self.cached(('cells', player), lambda: self.render_cells(player))
+        last = self.sent_cells[player]
+        ko = set(ko_indices(cells))
+        if last is None or self.turn - self.keyframe_turn[player] >= FIELD_KEYFRAME_TURNS:
+            self.sent_checksum[player] = board.field_checksum(cells)
+            self.keyframe_turn[player] = self.turn
+            update = self.full_field_update(player)
+        else:
+            checksum = self.sent_checksum[player]
+            changes = []
+            # every changed point goes out, even one that's back to what was
+            # last sent: the bot has since played its own move on its copy
+            for index in sorted(self.changed_points[player] | self.sent_ko[player] | ko):
+                checksum += (index + 1) * (cells[index] - last[index])
+                row, col = divmod(index, self.field_width)
+                changes.append('{0},{1},{2}'.format(col, row, cells[index]))
+            self.sent_checksum[player] = checksum % board.CHECKSUM_MODULUS
+            update = ['update game field_delta', self.sent_checksum[player], ';'.join(changes)]
+        self.sent_cells[player] = cells
+        self.sent_ko[player] = ko
+        self.changed_points[player] = set()
+        return update
+
     def parse_orders(self, player, lines):
         """ Parse orders from the given player
         """
@@ -133,11 +250,29 @@ class Go(Game):
                 continue
 
             if line[0] == '#':
-                ignored.append((line))
+                # a (line, reason) pair like the invalid ones, as do_moves
+                # formats both; a bare line made it raise a TypeError
+                ignored.append((line, 'comment'))
                 continue
 
             data = line.split()
 
+            if data[0] == 'settings':
+                if data[1:] == ['field_updates', 'delta']:
+                    # asking again resends the whole field, to resync
+                    self.delta_updates[player] = True
+                    self.sent_cells[player] = None
+                    valid.append(line)
+                elif data[1:] == ['field_updates', 'full']:
+                    self.delta_updates[player] = False
+                    valid.append(line)
+                elif data[1:2] == ['field_encoding'] and data[2:] in (['packed'], ['csv']):
+                    self.packed_fields[player] = data[2] == 'packed'
+                    valid.append(line)
+                else:
+                    invalid.append((line, 'unknown setting'))
+                continue
+
             # validate data format
             if data[0] != 'place_move' and data[0] != 'pass':
                 invalid.append((line, 'unknown action'))
@@ -171,30 +306,42 @@ class Go(Game):
 
 
     def place_move(self, move):
-        self.board.text_board()
-        print("\n")
+        if self.print_board:
+            self.board.text_board()
+            print("\n")
         (player_id, col, row) = move
         owner = self.board.get_owner(player_id)
         # owner = board.PLAYER2
         # if player_id == 0:
         #     owner = board.PLAYER1
 
-        if (row, col) in self.board.legal_moves(owner):
+        if self.board.is_legal(owner, row, col):
             self.last_move = (row, col)
             self.consecutive_passes = 0
-            self.board.place_move(owner, row, col)
+            captured = self.board.place_move(owner, row, col)
             self.board.push_state()
+            self.board_version += 1
+            self.turn_move = [player_id, row, col]
+            changed = [row * self.field_width + col]
+            changed.extend([r * self.field_width + c for (r, c) in captured])
+            for points in self.changed_points:
+                points.update(changed)
         else:
             print("PASS due to illegal move! " + str(move))
+            if 0 <= row < self.field_height and 0 <= col < self.field_width:
+                # the bot may have played it on its own copy of the field
+                self.changed_points[player_id].add(row * self.field_width + col)
             self.last_move = None
             self.consecutive_passes += 1
-        self.board.text_board()
+        if self.print_board:
+            self.board.text_board()
 #        print(self.board.to_csv())
 
     def do_orders(self):
         """ Execute player orders and handle conflicts
         """
         player = self.bots_to_play(self.turn)[0]
+        self.turn_move = [player]
         if self.is_alive(player):
             if len(self.orders[player]) > 0:
                 self.place_move (self.orders[player][0])
@@ -236,11 +383,11 @@ class Go(Game):
         self.game_started = True
         
         ### append turn 0 to replay
-        self.replay_data.append( self.get_state_changes(0, self.time_per_move) )
+        self.record_turn(0)
         result = []
 
     def score_game(self):
-        return self.board.count_scores() #[0, 0]
+        return list(self.cached('scores', self.board.count_scores))
 
     def finish_game(self):
         """ Called by engine at the end of the game """
@@ -262,7 +409,7 @@ class Go(Game):
     def finish_turn(self):
         """ Called by engine at the end of the turn """
         self.do_orders()
-        self.score = self.board.count_scores()
+        self.score = self.score_game()
         # record score in score history
         for i, s in enumerate(self.score):
             if self.is_alive(i):
@@ -276,7 +423,29 @@ class Go(Game):
         self.calc_significant_turns()
 
         ### append turn to replay
-        self.replay_data.append( self.get_state_changes(self.current_player(), self.time_per_move) )
+        self.record_turn(self.current_player())
+
+    def record_turn(self, player):
+        """ Add the turn just played to the replay, with the field as player sees it """
+        if self.replay_revision == REPLAY_REVISION:
+            cells = self.cached(('cells', player), lambda: self.render_cells(player))
+            entry = self.recorder.record(self.turn_move, self.board.collapse_array(), ko_indices(cells),
+                                         keep=self.keep_replay)
+        else:
+            entry = self.get_state_changes(player, self.time_per_move)
+            if self.keep_replay:
+                self.replay_data.append(entry)
+        if self.stream_replay:
+            self.pending_turns.append(entry)
+
+    def get_replay_turns(self):
+        """ Turns recorded since the last call, for streaming the replay
+
+            Used by the engine when the replay is written as the game runs
+        """
+        turns = self.pending_turns
+        self.pending_turns = []
+        return turns
 
     def calc_significant_turns(self):
         ranking_bots = [sorted(self.score, reverse=True).index(x) for x in self.score]
@@ -309,7 +478,10 @@ class Go(Game):
         result.append(['settings player_names', ','.join(self.use_player_names)])
         if player:
             result.append(['settings your_bot', self.use_player_names[player]])
-        result.append(['settings your_botid', player + 1])
+        # the stream log asks with no player, for which player + 1 used
+        # to raise a TypeError; player 0 still gets its your_botid
+        if player is not None:
+            result.append(['settings your_botid', player + 1])
         result.append(['settings field_width', self.field_width])
         result.append(['settings field_height', self.field_height])
 
@@ -387,8 +559,10 @@ class Go(Game):
         """
         replay = {}
         # required params
-        replay['revision'] = 1
+        replay['revision'] = self.replay_revision
         replay['players'] = self.num_players
+        replay['rows'] = self.field_height
+        replay['cols'] = self.field_width
 
         # optional params
         replay['loadtime'] = self.timebank
@@ -406,7 +580,11 @@ class Go(Game):
 
         
         ### 
-        replay['data'] = self.replay_data
+        if self.replay_revision == REPLAY_REVISION:
+            replay.update(self.recorder.get_replay())
+            replay['names'] = self.use_player_names
+        else:
+            replay['data'] = self.replay_data
         return replay
 
 
@@ -6,15 +6,16 @@ import os
 import time
 from optparse import OptionParser, OptionGroup
 import random
+import multiprocessing
+import multiprocessing.util
 import cProfile
-import json
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-
 import visualizer.visualize_locally
 from go import Go
+import rules
+from replay import ReplayWriter, read_stream
+from archive import ArchiveWriter
+from results import ResultsDB
+from botpool import BotPool
 
 #sys.path.append("../worker")
 try:
@@ -118,6 +119,15 @@ def main(argv):
     parser.add_option("-r", "--rounds", dest="rounds",
                       default=1, type="int",
                       help="Number of rounds to play")
+    parser.add_option("-j", "--jobs", dest="jobs",
+                      default=1, type="int",
+                      help="Number of rounds to play at once, each in a worker process")
+    parser.add_option("--warm_bots", dest="warm_bots",
+                      action="store_true", default=False,
+                      help="Keep bots running from one round to the next, for bots that answer 'new game' with 'ready'")
+    parser.add_option("--max_bot_games", dest="max_bot_games",
+                      default=100, type="int",
+                      help="Games a warm bot plays before it's restarted")
     parser.add_option("--player_seed", dest="player_seed",
                       default=None, type="int",
                       help="Player seed for the random number generator")
@@ -158,6 +168,20 @@ def main(argv):
                           help="Number of turns cutoff percentage is maintained to end game early")
     game_group.add_option("--scenario", dest="scenario",
                           action='store_true', default=False)
+    game_group.add_option("--ko_depth", dest="ko_depth", type="int", default=101,
+                          help="Number of previous positions checked for ko, 0 for positional superko over the whole game")
+    game_group.add_option("--field_width", dest="field_width", type="int", default=19,
+                          help="Number of columns on the board, up to 49")
+    game_group.add_option("--field_height", dest="field_height", type="int", default=19,
+                          help="Number of rows on the board, up to 49")
+    game_group.add_option("--no_print_board", dest="print_board",
+                          action="store_false", default=True,
+                          help="Don't print the board after every move")
+    game_group.add_option("--rules_backend", dest="rules_backend", default="board",
+                          type="choice", choices=sorted(rules.BACKENDS),
+                          help="Board implementation used to apply the rules")
+    game_group.add_option("--cross_check", dest="cross_check", type="float", default=0,
+                          help="Fraction of moves also checked against the reference board, reporting any divergence")
     parser.add_option_group(game_group)
 
     # the log directory must be specified for any logging to occur, except:
@@ -176,6 +200,19 @@ def main(argv):
                          action='store_true', default=False),
     log_group.add_option('-S', '--log_stream', dest='log_stream',
                          action='store_true', default=False),
+    log_group.add_option('--stream_replay', dest='stream_replay',
+                         action='store_true', default=False,
+                         help='Write the replay as JSON lines while the game runs, to <game id>.replay.jsonl')
+    log_group.add_option("--archive", dest="archive", default=None,
+                         help="Also append each game's replay to this replay archive")
+    log_group.add_option("--results_db", dest="results_db", default=None,
+                         help="Upsert each game's result into this SQLite database")
+    log_group.add_option("--replay_revision", dest="replay_revision",
+                         default=1, type="choice", choices=["1", "2"],
+                         help="Replay format: 1 stores every turn's field, 2 only the moves and periodic keyframes")
+    log_group.add_option("--keyframe_turns", dest="keyframe_turns",
+                         default=50, type="int",
+                         help="Turns between full fields in a revision 2 replay")
     log_group.add_option("-I", "--log_input", dest="log_input",
                          action="store_true", default=False,
                          help="Log input streams sent to bots")
@@ -234,37 +271,54 @@ def main(argv):
         traceback.print_exc()
         return -1
 
-def run_rounds(opts,args):
-    def get_cmd_wd(cmd, exec_rel_cwd=False):
-        ''' get the proper working directory from a command line '''
-        new_cmd = []
-        wd = None
-        for i, part in reversed(list(enumerate(cmd.split()))):
-            if wd == None and os.path.exists(part):
-                wd = os.path.dirname(os.path.realpath(part))
-                basename = os.path.basename(part)
-                if i == 0:
-                    if exec_rel_cwd:
-                        new_cmd.insert(0, os.path.join(".", basename))
-                    else:
-                        new_cmd.insert(0, part)
+def get_cmd_wd(cmd, exec_rel_cwd=False):
+    ''' get the proper working directory from a command line '''
+    new_cmd = []
+    wd = None
+    for i, part in reversed(list(enumerate(cmd.split()))):
+        if wd == None and os.path.exists(part):
+            wd = os.path.dirname(os.path.realpath(part))
+            basename = os.path.basename(part)
+            if i == 0:
+                if exec_rel_cwd:
+                    new_cmd.insert(0, os.path.join(".", basename))
                 else:
-                    new_cmd.insert(0, basename)
+                    new_cmd.insert(0, part)
             else:
-                new_cmd.insert(0, part)
-        return wd, ' '.join(new_cmd)
-    def get_cmd_name(cmd):
-        ''' get the name of a bot from the command line '''
-        for i, part in enumerate(reversed(cmd.split())):
-            if os.path.exists(part):
-                return os.path.basename(part)
+                new_cmd.insert(0, basename)
+        else:
+            new_cmd.insert(0, part)
+    return wd, ' '.join(new_cmd)
+
+def get_cmd_name(cmd):
+    ''' get the name of a bot from the command line '''
+    for i, part in enumerate(reversed(cmd.split())):
+        if os.path.exists(part):
+            return os.path.basename(part)
+
+def get_options(opts, args):
+    ''' the game and engine options shared by every round '''
 # this split of options is not needed, but left for documentation
     game_options = {
         "map": opts.map,
         "timebank": opts.loadtime,
         "time_per_move": opts.turntime,
 	"player_names" : args, #opts.player_names,
+        "field_width": opts.field_width,
+        "field_height": opts.field_height,
+        "print_board": opts.print_board,
+        "replay_revision": int(opts.replay_revision),
+        "keyframe_turns": opts.keyframe_turns,
+        "stream_replay": bool(opts.stream_replay and opts.log_dir),
+        # the .replay written at the end needs every turn, streamed or not
+        "keep_replay": bool(opts.log_replay or not (opts.stream_replay and opts.log_dir)),
         "scenario": opts.scenario }
+    if opts.ko_depth > 0:
+        game_options['ko_depth'] = opts.ko_depth
+    else:
+        game_options['ko_depth'] = None
+    game_options['board_class'] = rules.backend_factory(opts.rules_backend, opts.cross_check,
+                                                        seed=opts.engine_seed, log=stderr)
     if opts.player_seed != None:
         game_options['player_seed'] = opts.player_seed
     if opts.engine_seed != None:
@@ -288,146 +342,275 @@ def run_rounds(opts,args):
         "capture_errors": opts.capture_errors,
         "secure_jail": opts.secure_jail,
         "end_wait": opts.end_wait }
-    for round in range(opts.rounds):
-        # initialize game
-        game_id = round + opts.game_id
-#        with open(opts.map, 'r') as map_file:
-        game_options['map'] = ""# map_file.read()
-        if opts.engine_seed:
-            game_options['engine_seed'] = opts.engine_seed + round
-        game = Go(game_options)
-        # initialize bots
-        bots = [get_cmd_wd(arg, exec_rel_cwd=opts.secure_jail) for arg in args]
-        bot_count = len(bots)
-        # insure correct number of bots, or fill in remaining positions
-        if game.num_players != len(bots):
-            if game.num_players > len(bots) and opts.fill:
-                extra = game.num_players - len(bots)
-                for _ in range(extra):
-                    bots.append(bots[-1])
-            else:
-                print("Incorrect number of bots for map.  Need {0}, got {1}"
-                      .format(game.num_players, len(bots)), file=stderr)
-                for arg in args:
-                    print("Bot Cmd: {0}".format(arg), file=stderr)
-                break
-        bot_count = len(bots)
-        # move position of first bot specified
-        if opts.position > 0 and opts.position <= len(bots):
-            first_bot = bots[0]
-            bots = bots[1:]
-            bots.insert(opts.position, first_bot)
-
-        # initialize file descriptors
-        if opts.log_dir and not os.path.exists(opts.log_dir):
-            os.mkdir(opts.log_dir)
-        if not opts.log_replay and not opts.log_stream and (opts.log_dir or opts.log_stdout):
-            opts.log_replay = True
-        replay_path = None # used for visualizer launch
-
-        if opts.log_replay:
-            if opts.log_dir:
-                replay_path = os.path.join(opts.log_dir, '{0}.replay'.format(game_id))
-                engine_options['replay_log'] = open(replay_path, 'w')
-            if opts.log_stdout:
-                if 'replay_log' in engine_options and engine_options['replay_log']:
-                    engine_options['replay_log'] = Tee(sys.stdout, engine_options['replay_log'])
-                else:
-                    engine_options['replay_log'] = sys.stdout
-        else:
-            engine_options['replay_log'] = None
+    if opts.warm_bots:
+        engine_options['bot_pool'] = BotPool(opts.max_bot_games)
+    return game_options, engine_options
 
-        if opts.log_stream:
-            if opts.log_dir:
-                engine_options['stream_log'] = open(os.path.join(opts.log_dir, '{0}.stream'.format(game_id)), 'w')
-            if opts.log_stdout:
-                if engine_options['stream_log']:
-                    engine_options['stream_log'] = Tee(sys.stdout, engine_options['stream_log'])
-                else:
-                    engine_options['stream_log'] = sys.stdout
+def get_bots(opts, args, num_players):
+    ''' (working directory, command) of each seat, None if they don't fit '''
+    bots = [get_cmd_wd(arg, exec_rel_cwd=opts.secure_jail) for arg in args]
+    # insure correct number of bots, or fill in remaining positions
+    if num_players != len(bots):
+        if num_players > len(bots) and opts.fill:
+            extra = num_players - len(bots)
+            for _ in range(extra):
+                bots.append(bots[-1])
         else:
-            engine_options['stream_log'] = None
+            print("Incorrect number of bots for map.  Need {0}, got {1}"
+                  .format(num_players, len(bots)), file=stderr)
+            for arg in args:
+                print("Bot Cmd: {0}".format(arg), file=stderr)
+            return None
+    # move position of first bot specified
+    if opts.position > 0 and opts.position <= len(bots):
+        first_bot = bots[0]
+        bots = bots[1:]
+        bots.insert(opts.position, first_bot)
+    return bots
 
-        if opts.log_input and opts.log_dir:
-            engine_options['input_logs'] = [open(os.path.join(opts.log_dir, '{0}.bot{1}.input'.format(game_id, i)), 'w')
-                             for i in range(bot_count)]
-        else:
-            engine_options['input_logs'] = None
-        if opts.log_output and opts.log_dir:
-            engine_options['output_logs'] = [open(os.path.join(opts.log_dir, '{0}.bot{1}.output'.format(game_id, i)), 'w')
-                              for i in range(bot_count)]
-        else:
-            engine_options['output_logs'] = None
-        if opts.log_error and opts.log_dir:
-            if opts.log_stderr:
-                if opts.log_stdout:
-                    engine_options['error_logs'] = [Tee(Comment(stderr), open(os.path.join(opts.log_dir, '{0}.bot{1}.error'.format(game_id, i)), 'w'))
-                                      for i in range(bot_count)]
-                else:
-                    engine_options['error_logs'] = [Tee(stderr, open(os.path.join(opts.log_dir, '{0}.bot{1}.error'.format(game_id, i)), 'w'))
-                                      for i in range(bot_count)]
+def play_round(opts, args, round, game_options, engine_options):
+    ''' play one round, returning (game id, result, replay path)
+
+    The result is None when the bots don't fit the map.
+    '''
+    # initialize game
+    game_id = round + opts.game_id
+#    with open(opts.map, 'r') as map_file:
+    game_options['map'] = ""# map_file.read()
+    if opts.engine_seed:
+        game_options['engine_seed'] = opts.engine_seed + round
+    game = Go(game_options)
+    # initialize bots
+    bots = get_bots(opts, args, game.num_players)
+    if bots is None:
+        return game_id, None, None
+    bot_count = len(bots)
+
+    # initialize file descriptors
+    replay_path = None # used for visualizer launch
+
+    if opts.stream_replay and opts.log_dir:
+        replay_path = os.path.join(opts.log_dir, '{0}.replay.jsonl'.format(game_id))
+        engine_options['replay_writer'] = ReplayWriter(open(replay_path, 'w'))
+    else:
+        engine_options['replay_writer'] = None
+
+    if opts.log_replay:
+        if opts.log_dir:
+            replay_path = os.path.join(opts.log_dir, '{0}.replay'.format(game_id))
+            engine_options['replay_log'] = open(replay_path, 'w')
+        if opts.log_stdout:
+            if 'replay_log' in engine_options and engine_options['replay_log']:
+                engine_options['replay_log'] = Tee(sys.stdout, engine_options['replay_log'])
             else:
-                engine_options['error_logs'] = [open(os.path.join(opts.log_dir, '{0}.bot{1}.error'.format(game_id, i)), 'w')
-                                  for i in range(bot_count)]
-        elif opts.log_stderr:
-            if opts.log_stdout:
-                engine_options['error_logs'] = [Comment(stderr)] * bot_count
+                engine_options['replay_log'] = sys.stdout
+    else:
+        engine_options['replay_log'] = None
+
+    if opts.log_stream:
+        if opts.log_dir:
+            engine_options['stream_log'] = open(os.path.join(opts.log_dir, '{0}.stream'.format(game_id)), 'w')
+        if opts.log_stdout:
+            if engine_options['stream_log']:
+                engine_options['stream_log'] = Tee(sys.stdout, engine_options['stream_log'])
             else:
-                engine_options['error_logs'] = [stderr] * bot_count
-        else:
-            engine_options['error_logs'] = None
+                engine_options['stream_log'] = sys.stdout
+    else:
+        engine_options['stream_log'] = None
 
-        if opts.verbose:
+    if opts.log_input and opts.log_dir:
+        engine_options['input_logs'] = [open(os.path.join(opts.log_dir, '{0}.bot{1}.input'.format(game_id, i)), 'w')
+                         for i in range(bot_count)]
+    else:
+        engine_options['input_logs'] = None
+    if opts.log_output and opts.log_dir:
+        engine_options['output_logs'] = [open(os.path.join(opts.log_dir, '{0}.bot{1}.output'.format(game_id, i)), 'w')
+                          for i in range(bot_count)]
+    else:
+        engine_options['output_logs'] = None
+    if opts.log_error and opts.log_dir:
+        if opts.log_stderr:
             if opts.log_stdout:
-                engine_options['verbose_log'] = Comment(sys.stdout)
-            else:
-                engine_options['verbose_log'] = sys.stdout
-
-        engine_options['game_id'] = game_id
-        if opts.rounds > 1:
-            print('# playgame round {0}, game id {1}'.format(round, game_id))
-
-        # intercept replay log so we can add player names
-        if opts.log_replay:
-            intcpt_replay_io = StringIO()
-            real_replay_io = engine_options['replay_log']
-            engine_options['replay_log'] = intcpt_replay_io
-
-        result = run_game(game, bots, engine_options)
-
-        # add player names, write to proper io, reset back to normal
-        if opts.log_replay:
-            replay_json = json.loads(intcpt_replay_io.getvalue())
-            replay_json['playernames'] = [get_cmd_name(arg) for arg in args]
-            real_replay_io.write(json.dumps(replay_json))
-            intcpt_replay_io.close()
-            engine_options['replay_log'] = real_replay_io
-
-        # close file descriptors
-        if engine_options['stream_log']:
-            engine_options['stream_log'].close()
-        if engine_options['replay_log']:
-            engine_options['replay_log'].close()
-        if engine_options['input_logs']:
-            for input_log in engine_options['input_logs']:
-                input_log.close()
-        if engine_options['output_logs']:
-            for output_log in engine_options['output_logs']:
-                output_log.close()
-        if engine_options['error_logs']:
-            for error_log in engine_options['error_logs']:
-                error_log.close()
-        if replay_path:
-            if opts.nolaunch:
-                if opts.html_file:
-                    visualizer.visualize_locally.launch(replay_path, True, opts.html_file)
+                engine_options['error_logs'] = [Tee(Comment(stderr), open(os.path.join(opts.log_dir, '{0}.bot{1}.error'.format(game_id, i)), 'w'))
+                                  for i in range(bot_count)]
             else:
-                if opts.html_file == None:
-                    visualizer.visualize_locally.launch(replay_path,
-                            generated_path="replay.{0}.html".format(game_id))
+                engine_options['error_logs'] = [Tee(stderr, open(os.path.join(opts.log_dir, '{0}.bot{1}.error'.format(game_id, i)), 'w'))
+                                  for i in range(bot_count)]
+        else:
+            engine_options['error_logs'] = [open(os.path.join(opts.log_dir, '{0}.bot{1}.error'.format(game_id, i)), 'w')
+                              for i in range(bot_count)]
+    elif opts.log_stderr:
+        if opts.log_stdout:
+            engine_options['error_logs'] = [Comment(stderr)] * bot_count
+        else:
+            engine_options['error_logs'] = [stderr] * bot_count
+    else:
+        engine_options['error_logs'] = None
+
+    if opts.verbose:
+        if opts.log_stdout:
+            engine_options['verbose_log'] = Comment(sys.stdout)
+        else:
+            engine_options['verbose_log'] = sys.stdout
+
+    engine_options['game_id'] = game_id
+    if opts.rounds > 1:
+        print('# playgame round {0}, game id {1}'.format(round, game_id))
+
+    engine_options['playernames'] = [get_cmd_name(arg) for arg in args]
+
+    result = run_game(game, bots, engine_options)
+    if opts.cross_check > 0:
+        print(game.board.report(), file=stderr)
+
+    # close file descriptors
+    if engine_options['replay_writer']:
+        engine_options['replay_writer'].close()
+    if engine_options['stream_log']:
+        engine_options['stream_log'].close()
+    if engine_options['replay_log']:
+        engine_options['replay_log'].close()
+    if engine_options['input_logs']:
+        for input_log in engine_options['input_logs']:
+            input_log.close()
+    if engine_options['output_logs']:
+        for output_log in engine_options['output_logs']:
+            output_log.close()
+    if engine_options['error_logs']:
+        for error_log in engine_options['error_logs']:
+            error_log.close()
+    return game_id, result, replay_path
+
+# the options of a --jobs worker process, see init_worker
+worker_state = None
+
+def init_worker(opts, args):
+    global worker_state
+    # forked workers start with the parent's random state, and Go seeds
+    # any round without --engine_seed from it
+    random.seed()
+    worker_state = (opts, args) + get_options(opts, args)
+    bot_pool = worker_state[3].get('bot_pool')
+    if bot_pool:
+        # workers exit through multiprocessing's finalizers, not atexit
+        multiprocessing.util.Finalize(bot_pool, bot_pool.close, exitpriority=10)
+
+def play_worker_round(round):
+    (opts, args, game_options, engine_options) = worker_state
+    try:
+        return play_round(opts, args, round, game_options, engine_options)
+    finally:
+        # the pool is terminated at the end, which skips flushing at exit
+        sys.stdout.flush()
+
+class RoundSummary(object):
+    ''' Statuses and wins of each bot over the rounds played '''
+    def __init__(self):
+        self.games = 0
+        self.errors = 0
+        self.bots = {}
+    def add(self, result):
+        self.games += 1
+        if result.get('error'):
+            self.errors += 1
+        ranks = result.get('rank') or []
+        names = result.get('playernames') or []
+        for seat, status in enumerate(result.get('status') or []):
+            # --fill repeats the last bot
+            name = names[min(seat, len(names) - 1)] if names else 'bot{0}'.format(seat)
+            bot = self.bots.setdefault(name, {'games': 0, 'wins': 0, 'draws': 0, 'statuses': {}})
+            bot['games'] += 1
+            if seat < len(ranks) and ranks[seat] == 0:
+                if ranks.count(0) == 1:
+                    bot['wins'] += 1
                 else:
-                    visualizer.visualize_locally.launch(replay_path,
-                            generated_path=opts.html_file)
+                    bot['draws'] += 1
+            bot['statuses'][status] = bot['statuses'].get(status, 0) + 1
+    def write(self, file, seconds):
+        print('# playgame {0} games in {1:.1f} seconds, {2} with errors'
+              .format(self.games, seconds, self.errors), file=file)
+        for name in sorted(self.bots):
+            bot = self.bots[name]
+            print('# {0}: {1} games, {2} wins, {3} draws, {4}'.format(
+                name, bot['games'], bot['wins'], bot['draws'],
+                ' '.join('{0}:{1}'.format(status, count)
+                         for status, count in sorted(bot['statuses'].items()))), file=file)
+
+def run_rounds(opts,args):
+    # set up what every round shares before any round, or worker, starts
+    if opts.log_dir and not os.path.exists(opts.log_dir):
+        os.mkdir(opts.log_dir)
+    if not opts.log_replay and not opts.log_stream and not opts.stream_replay and (opts.log_dir or opts.log_stdout):
+        opts.log_replay = True
+    jobs = min(opts.jobs, opts.rounds)
+    if jobs > 1:
+        # check the bots fit once here, rather than in every worker
+        if get_bots(opts, args, Go(get_options(opts, args)[0]).num_players) is None:
+            return
+    archive = ArchiveWriter(opts.archive) if opts.archive else None
+    results_db = ResultsDB(opts.results_db) if opts.results_db else None
+    summary = RoundSummary()
+    start = time.time()
+    pool = None
+    bot_pool = None
+    if jobs > 1:
+        # rounds go to the workers and their results come back as they finish;
+        # the archive, results database and visualizer stay in this process
+        pool = multiprocessing.Pool(jobs, init_worker, (opts, args))
+        rounds = pool.imap_unordered(play_worker_round, range(opts.rounds))
+    else:
+        game_options, engine_options = get_options(opts, args)
+        bot_pool = engine_options.get('bot_pool')
+        rounds = (play_round(opts, args, round, game_options, engine_options)
+                  for round in range(opts.rounds))
+    try:
+        for game_id, result, replay_path in rounds:
+            if result is None:
+                break
+            summary.add(result)
+            archive_offset = None
+            if archive:
+                if opts.stream_replay and opts.log_dir and not opts.log_replay:
+                    # a streaming game kept none of its turns, they're on disk
+                    with open(replay_path, 'r') as replay_file:
+                        result = read_stream(replay_file)
+                archive_offset = archive.append(game_id, result)
+            if results_db:
+                results_db.add(game_id, result, replay_path=replay_path,
+                               archive_path=opts.archive, archive_offset=archive_offset)
+            if archive and not replay_path:
+                replay_path = opts.archive
+            if replay_path:
+                if opts.nolaunch:
+                    if opts.html_file:
+                        visualizer.visualize_locally.launch(replay_path, True, opts.html_file,
+                                                            game_id=game_id, offset=archive_offset)
+                else:
+                    if opts.html_file == None:
+                        visualizer.visualize_locally.launch(replay_path,
+                                generated_path="replay.{0}.html".format(game_id), game_id=game_id,
+                                offset=archive_offset)
+                    else:
+                        visualizer.visualize_locally.launch(replay_path,
+                                generated_path=opts.html_file, game_id=game_id,
+                                offset=archive_offset)
+        if pool:
+            # let the workers exit by themselves, so they kill their warm bots
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            # stops the other workers too if a round failed
+            pool.terminate()
+            pool.join()
+        if bot_pool:
+            bot_pool.close()
+        if archive:
+            archive.close()
+        if results_db:
+            results_db.close()
+    if opts.rounds > 1:
+        summary.write(sys.stdout, time.time() - start)
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
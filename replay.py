@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+""" Replay revision 2: moves, ko marks and keyframes instead of every field
+
+Revision 1 replays keep the whole get_state_changes list for every
+turn, CSV field included. Revision 2 keeps one small entry per turn:
+
+    moves      [] before any move, [player] for a pass or a move that
+               wasn't played, [player, row, col] for a stone
+    ko         [turn, [index, ...]] for the turns whose field marks ko
+               points, with index = row * cols + col
+    keyframes  [turn, board.encode_field(cells)] every keyframe_turns turns
+
+Any turn's field is rebuilt by loading the nearest keyframe at or before
+it and playing the moves after it with the rules engine. ReplayDecoder
+does that, and to_legacy() turns a revision 2 replay back into
+revision 1 for the visualizer.
+
+ReplayWriter streams a replay of either revision as JSON lines while the
+game runs, and read_stream() turns those lines back into the single JSON
+replay the engine would have written.
+"""
+import json
+
+import board
+
+REVISION = 2
+KEYFRAME_TURNS = 50
+
+class ReplayRecorder:
+    """ Collects the revision 2 data as Go plays """
+
+    def __init__(self, keyframe_turns=KEYFRAME_TURNS):
+        self.keyframe_turns = keyframe_turns
+        self.turns = 0
+        self.moves = []
+        self.ko = []
+        self.keyframes = []
+
+    def record(self, move, cells, ko, keep=True):
+        """ Add the next turn: its move, the field without ko marks and the ko indices
+
+        Returns the turn's entry for a ReplayWriter. With keep False the
+        entry is only returned, for replays streamed as they're played.
+        """
+        turn = self.turns
+        self.turns += 1
+        entry = {'move': move}
+        if ko:
+            entry['ko'] = ko
+        if turn % self.keyframe_turns == 0:
+            entry['keyframe'] = board.encode_field(cells)
+        if keep:
+            add_entry(self.get_replay(), turn, entry)
+        return entry
+
+    def get_replay(self):
+        return {
+            'revision': REVISION,
+            'keyframe_turns': self.keyframe_turns,
+            'moves': self.moves,
+            'ko': self.ko,
+            'keyframes': self.keyframes,
+        }
+
+# End of ReplayRecorder class
+
+def add_entry(replay, turn, entry):
+    """ Append a ReplayRecorder entry to revision 2 replay data """
+    replay['moves'].append(entry['move'])
+    if 'ko' in entry:
+        replay['ko'].append([turn, entry['ko']])
+    if 'keyframe' in entry:
+        replay['keyframes'].append([turn, entry['keyframe']])
+
+def entries(replay):
+    """ The ReplayRecorder entries of revision 2 replay data, one per turn """
+    ko = dict((turn, indices) for (turn, indices) in replay['ko'])
+    keyframes = dict((turn, data) for (turn, data) in replay['keyframes'])
+    for (turn, move) in enumerate(replay['moves']):
+        entry = {'move': move}
+        if turn in ko:
+            entry['ko'] = ko[turn]
+        if turn in keyframes:
+            entry['keyframe'] = keyframes[turn]
+        yield entry
+
+
+class ReplayDecoder:
+    """ Rebuilds the fields of a revision 2 replay """
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.rows = replay['rows']
+        self.cols = replay['cols']
+        self.moves = replay['moves']
+        self.ko = dict((turn, indices) for (turn, indices) in replay['ko'])
+        self.keyframes = dict((turn, data) for (turn, data) in replay['keyframes'])
+
+    def turns(self):
+        return len(self.moves)
+
+    def _load(self, turn):
+        """ A board holding keyframe turn """
+        result = board.Board(self.cols, self.rows)
+        cells = board.decode_field(self.keyframes[turn], self.rows * self.cols)
+        result.cell = [cells[row * self.cols:(row + 1) * self.cols] for row in range(0, self.rows)]
+        result.rebuild_chains()
+        return result
+
+    def _play(self, position, turn):
+        move = self.moves[turn]
+        if len(move) == 3:
+            (player, row, col) = move
+            position.place_move(position.get_owner(player), row, col)
+
+    def board_at(self, turn):
+        """ board.Board with the stones on the field after turn """
+        keyframe = max(t for t in self.keyframes if t <= turn)
+        position = self._load(keyframe)
+        for later in range(keyframe + 1, turn + 1):
+            self._play(position, later)
+        return position
+
+    def _field(self, position, turn):
+        cells = position.collapse_array()
+        for index in self.ko.get(turn, []):
+            cells[index] = board.KO
+        return cells
+
+    def field_at(self, turn):
+        """ Cell values of the field sent after turn, ko marks included """
+        return self._field(self.board_at(turn), turn)
+
+    def fields(self):
+        """ Every turn's field in order, playing through the game once """
+        position = None
+        for turn in range(0, self.turns()):
+            if turn in self.keyframes:
+                position = self._load(turn)
+            else:
+                self._play(position, turn)
+            yield self._field(position, turn)
+
+    def to_legacy(self):
+        """ The replay as revision 1, with the full state changes of every turn """
+        legacy = dict(self.replay)
+        for key in ('keyframe_turns', 'moves', 'ko', 'keyframes'):
+            del legacy[key]
+        legacy['revision'] = 1
+        names = self.replay.get('names', ['Player1', 'Player2'])
+        data = []
+        for (turn, cells) in enumerate(self.fields()):
+            changes = [['update game round', int(turn / 2)], ['update game move', turn],
+                       ['update game field', ','.join([board.CSV_VALUES[cell] for cell in cells])]]
+            move = self.moves[turn]
+            if len(move) == 3:
+                changes.append(['update ' + names[move[0]] + ' last_move place_move', move[2], move[1]])
+            elif move and turn > 1:
+                changes.append(['update ' + names[move[0]] + ' last_move pass'])
+            data.append(changes)
+        legacy['data'] = data
+        return legacy
+
+# End of ReplayDecoder class
+
+def to_legacy(replay):
+    """ A revision 1 copy of replay data of either revision """
+    if replay.get('revision') == REVISION:
+        return ReplayDecoder(replay).to_legacy()
+    return replay
+
+
+class ReplayWriter:
+    """ Writes a replay as JSON lines while the game is played
+
+    A header record comes first, then one record per turn as the game
+    hands its turns over, then a trailer with the game result. Every
+    line is flushed as it's written, so if the engine dies the turns
+    played so far are still on disk.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.turns = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':'), sort_keys=True))
+        self.file.write('\n')
+        self.file.flush()
+
+    def header(self, fields):
+        self.write(dict(fields, type='header'))
+
+    def turn(self, data, scores):
+        self.write({'type': 'turn', 'turn': self.turns, 'data': data, 'scores': scores})
+        self.turns += 1
+
+    def trailer(self, result):
+        self.write(dict(result, type='trailer'))
+
+    def close(self):
+        self.file.close()
+
+# End of ReplayWriter class
+
+def read_stream(lines):
+    """ The single JSON replay for the lines of a ReplayWriter stream
+
+    A stream cut short by a crash gives the header fields, the turns
+    that made it to disk and status 'incomplete'.
+    """
+    header = {}
+    turns = []
+    trailer = None
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # the last line of a stream cut short may be half written
+            break
+        kind = record.pop('type', None)
+        if kind == 'header':
+            header = record
+        elif kind == 'turn':
+            turns.append(record)
+        elif kind == 'trailer':
+            trailer = record
+    if trailer is None:
+        result = dict((key, value) for (key, value) in header.items() if key != 'replaydata')
+        result['status'] = 'incomplete'
+        result['game_length'] = len(turns)
+    else:
+        result = trailer
+    replaydata = dict(header.get('replaydata', {}))
+    replaydata.update(result.get('replaydata', {}))
+    if trailer is None:
+        replaydata['scores'] = [list(scores) for scores in zip(*[turn['scores'] for turn in turns])]
+    if replaydata.get('revision') == REVISION:
+        replaydata['moves'] = []
+        replaydata['ko'] = []
+        replaydata['keyframes'] = []
+        for turn in turns:
+            add_entry(replaydata, turn['turn'], turn['data'])
+    else:
+        replaydata['data'] = [turn['data'] for turn in turns]
+    if 'error' not in result:
+        result['replaydata'] = replaydata
+    return result
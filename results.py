@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+""" Results database: game summaries in SQLite for tournament runs
+
+Each game run_game plays is upserted as one games row and one players
+row per seat. Games are numbered in the order they're first added, and
+a game is known by its run and game id: each ResultsDB is a run with a
+fresh run_id unless it's given one, as playgame starts its game ids
+over every time, so only the same game added again in the same run
+replaces its old rows. Seat 0 is player1, who moves first with black.
+
+The database is in WAL mode and every add takes its write lock up
+front, so several playgame workers can share one file; each waits up
+to timeout seconds for the others.
+
+    python results.py results.db bot_a --opponent bot_b --seat 0 --last 50000
+    python results.py results.db --import logs/*.replay
+"""
+from __future__ import print_function
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from optparse import OptionParser
+
+GAME_COLUMNS = ['run_id', 'game_id', 'finished', 'challenge', 'error', 'game_length', 'cutoff',
+                'winner', 'engine_seed', 'player_seed', 'rows', 'cols', 'turntime', 'loadtime',
+                'duration', 'replay_path', 'archive_path', 'archive_offset']
+PLAYER_COLUMNS = ['game', 'seat', 'bot', 'status', 'score', 'rank', 'playerturns', 'time']
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY,
+        run_id TEXT NOT NULL,
+        game_id TEXT NOT NULL,
+        finished REAL,
+        challenge TEXT,
+        error TEXT,
+        game_length INTEGER,
+        cutoff TEXT,
+        winner INTEGER,
+        engine_seed INTEGER,
+        player_seed INTEGER,
+        rows INTEGER,
+        cols INTEGER,
+        turntime INTEGER,
+        loadtime INTEGER,
+        duration REAL,
+        replay_path TEXT,
+        archive_path TEXT,
+        archive_offset INTEGER,
+        UNIQUE (run_id, game_id))""",
+    """CREATE TABLE IF NOT EXISTS players (
+        game INTEGER NOT NULL REFERENCES games (id),
+        seat INTEGER NOT NULL,
+        bot TEXT,
+        status TEXT,
+        score REAL,
+        rank INTEGER,
+        playerturns INTEGER,
+        time REAL,
+        PRIMARY KEY (game, seat))""",
+    "CREATE INDEX IF NOT EXISTS games_finished ON games (finished)",
+    "CREATE INDEX IF NOT EXISTS players_bot ON players (bot, seat, game)",
+]
+# PRAGMA user_version of a database with the schema above; one made
+# before the schema was versioned reads 0
+SCHEMA_VERSION = 1
+
+def _upsert(table, columns, key):
+    return "INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT ({3}) DO UPDATE SET {4}".format(
+        table, ", ".join(columns), ", ".join("?" for column in columns), ", ".join(key),
+        ", ".join("{0} = excluded.{0}".format(column) for column in columns if column not in key))
+
+UPSERT_GAME = _upsert('games', GAME_COLUMNS, ['run_id', 'game_id'])
+UPSERT_PLAYER = _upsert('players', PLAYER_COLUMNS, ['game', 'seat'])
+GAME_KEY = "SELECT id FROM games WHERE run_id = ? AND game_id = ?"
+
+def _seat(values, seat):
+    if values and seat < len(values):
+        return values[seat]
+    return None
+
+def summarize(run_id, game_id, result, replay_path=None, archive_path=None, archive_offset=None,
+              finished=None):
+    """ (games row, players rows) for a game result from run_game
+
+    The players rows start with None for the game's key, which add_many
+    fills in once the games row is in.
+    """
+    replaydata = result.get('replaydata') or {}
+    ranks = result.get('rank') or []
+    winner = None
+    if ranks.count(0) == 1:
+        winner = ranks.index(0)
+    cutoff = replaydata.get('cutoff')
+    game = [str(run_id), str(game_id), finished if finished is not None else time.time(),
+            result.get('challenge'), result.get('error') or None, result.get('game_length'),
+            None if cutoff is None else str(cutoff), winner,
+            replaydata.get('engine_seed'), replaydata.get('player_seed'),
+            replaydata.get('rows'), replaydata.get('cols'),
+            replaydata.get('turntime'), replaydata.get('loadtime'), result.get('duration'),
+            replay_path, archive_path, archive_offset]
+    names = result.get('playernames') or result.get('bot_ids') or []
+    # playgame --fill names only the bots given, the last one filling the other seats
+    players = [[None, seat, names[min(seat, len(names) - 1)] if names else None, status, _seat(result.get('score'), seat),
+                _seat(ranks, seat), _seat(result.get('playerturns'), seat),
+                _seat(result.get('playertime'), seat)]
+               for (seat, status) in enumerate(result.get('status') or [])]
+    return (game, players)
+
+
+class ResultsDB:
+    """ An SQLite results database, created on first use """
+
+    def __init__(self, path, timeout=30.0, run_id=None):
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex
+        # transactions are begun explicitly, see add_many
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+            tables = self.connection.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name = 'games'").fetchone()[0]
+            if tables and version != SCHEMA_VERSION:
+                raise ValueError("{0} has results schema {1}, expected {2}; import its replays into a new database"
+                                 .format(path, version, SCHEMA_VERSION))
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.connection.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def add(self, game_id, result, **locations):
+        """ Upsert one game of this run, see summarize for the replay locations """
+        self.add_many([summarize(self.run_id, game_id, result, **locations)])
+
+    def add_many(self, summaries):
+        """ Upsert summarize() rows in one transaction
+
+        BEGIN IMMEDIATE takes the write lock before reading anything, so
+        concurrent writers queue on the busy timeout rather than failing
+        to upgrade a read lock.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            for (game, players) in summaries:
+                self.connection.execute(UPSERT_GAME, game)
+                (key,) = self.connection.execute(GAME_KEY, game[:2]).fetchone()
+                self.connection.executemany(UPSERT_PLAYER, [[key] + player[1:] for player in players])
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def win_rate(self, bot, opponent=None, seat=None, last=None):
+        """ (wins, games) for bot over its last games without an error
+
+        Only games against opponent when given, and only those bot played
+        from seat when that's given; last limits it to the latest games.
+        """
+        query = ["SELECT g.winner = a.seat AS won FROM players a",
+                 "JOIN games g ON g.id = a.game"]
+        params = []
+        if opponent is not None:
+            # two seats, so the opponent's seat pins down the players_bot lookup
+            query.append("JOIN players b ON b.bot = ? AND b.seat = 1 - a.seat AND b.game = a.game")
+            params.append(opponent)
+        query.append("WHERE a.bot = ? AND g.error IS NULL")
+        params.append(bot)
+        if seat is not None:
+            query.append("AND a.seat = ?")
+            params.append(seat)
+        # latest added first
+        query.append("ORDER BY a.game DESC")
+        if last is not None:
+            query.append("LIMIT ?")
+            params.append(last)
+        (wins, games) = self.connection.execute(
+            "SELECT COALESCE(SUM(won), 0), COUNT(*) FROM ({0})".format(" ".join(query)),
+            params).fetchone()
+        return (wins, games)
+
+    def close(self):
+        self.connection.close()
+
+# End of ResultsDB class
+
+def import_replays(db, paths):
+    """ Add replay files to db in one transaction
+
+    Each is its own run, its path, so importing a file again replaces
+    it; the game id is from the file name.
+    """
+    summaries = []
+    for path in paths:
+        with open(path, 'r') as replay_file:
+            result = json.load(replay_file)
+        game_id = os.path.basename(path).split('.')[0]
+        if game_id.isdigit():
+            game_id = int(game_id)
+        summaries.append(summarize(os.path.abspath(path), game_id, result, replay_path=path,
+                                   finished=os.path.getmtime(path)))
+    db.add_many(summaries)
+    return len(summaries)
+
+def main(argv):
+    parser = OptionParser(usage="Usage: %prog [options] database [bot | replay files]")
+    parser.add_option("--import", dest="import_replays", action="store_true", default=False,
+                      help="Add the replay files given to the database")
+    parser.add_option("--opponent", dest="opponent", default=None,
+                      help="Only count games against this bot")
+    parser.add_option("--seat", dest="seat", type="int", default=None,
+                      help="Only count games the bot played from this seat, 0 for black")
+    parser.add_option("--last", dest="last", type="int", default=None,
+                      help="Only count the bot's latest games")
+    (opts, args) = parser.parse_args(argv)
+    if len(args) < 2:
+        parser.error("expected a database and a bot name or replay files")
+
+    db = ResultsDB(args[0])
+    if opts.import_replays:
+        print("added {0} games".format(import_replays(db, args[1:])))
+    else:
+        start = time.time()
+        (wins, games) = db.win_rate(args[1], opts.opponent, opts.seat, opts.last)
+        print("{0} won {1} of {2} games ({3:.1%}) in {4:.1f} ms".format(
+            args[1], wins, games, float(wins) / games if games else 0.0,
+            1000 * (time.time() - start)))
+    db.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
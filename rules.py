@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+""" Rules backends: the board implementations Go can run on
+
+A backend is a class built as backend(width, height, ko_depth,
+track_territory=...) that provides what Go needs from a board:
+
+    get_owner(player)          PLAYER1 or PLAYER2 for a player index
+    is_legal(owner, row, col)  empty, not suicide and not ko
+    place_move(owner, row, col) place and capture, returns captured (row, col)s
+    push_state()               record the position for ko checks
+    mark_ko(player), unmark_ko() show the ko points in to_csv()
+    count_scores()             [PLAYER1 score, PLAYER2 score] with KOMI
+    to_csv(), text_board()     render the field
+    hash                       Zobrist hash of the position, as in board.zobrist_table
+
+board.Board is the reference implementation. Other backends are checked
+against it with CrossCheck before they're trusted with real games.
+"""
+import random
+import sys
+
+import board
+import bitboard
+
+BACKENDS = {
+    'board': board.Board,
+    'flat': board.FlatBoard,
+    'bitboard': bitboard.BitBoard,
+}
+
+def register_backend(name, backend):
+    BACKENDS[name] = backend
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("unknown rules backend {0!r}, expected one of {1}"
+                         .format(name, ", ".join(sorted(BACKENDS))))
+
+def backend_factory(name, cross_check=0, seed=None, log=None):
+    """ What Go should take as board_class for a backend name
+
+    With cross_check above 0, that fraction of positions is also checked
+    against board.Board.
+    """
+    backend = get_backend(name)
+    if cross_check <= 0:
+        return backend
+    def factory(width, height, ko_depth=board.KO_BOARDS, track_territory=False):
+        return CrossCheck(backend, board.Board, width, height, ko_depth, track_territory,
+                          fraction=cross_check, seed=seed, log=log)
+    return factory
+
+
+class CrossCheck:
+    """ A backend run in lockstep with a reference board
+
+    Every move is played on both so their positions stay the same, but
+    answers are only compared in a sampled fraction of the positions,
+    and the backend's answer is always the one returned. Each difference
+    is written to log and kept in divergences as (move, call, got,
+    expected).
+    """
+
+    def __init__(self, backend, reference, width, height, ko_depth=board.KO_BOARDS,
+                 track_territory=False, fraction=0.1, seed=None, log=None):
+        self.board = backend(width, height, ko_depth, track_territory=track_territory)
+        self.reference = reference(width, height, ko_depth, track_territory=track_territory)
+        self.fraction = fraction
+        self.rand = random.Random(seed)
+        self.log = log or sys.stderr
+        self.moves = 0
+        self.sampled_positions = 0
+        self.divergences = []
+        self._sample()
+
+    def __getattr__(self, name):
+        return getattr(self.board, name)
+
+    def _sample(self):
+        self.sampled = self.rand.random() < self.fraction
+        if self.sampled:
+            self.sampled_positions += 1
+
+    def _compare(self, call, got, expected):
+        if got != expected:
+            self.divergences.append((self.moves, call, got, expected))
+            self.log.write("cross check: {0} differs at move {1}: {2} gave {3!r}, {4} gave {5!r}\n"
+                           .format(call, self.moves, self.board.__class__.__name__, got,
+                                   self.reference.__class__.__name__, expected))
+
+    def get_owner(self, player):
+        return self.board.get_owner(player)
+
+    def is_legal(self, owner, row, col):
+        got = self.board.is_legal(owner, row, col)
+        if self.sampled:
+            self._compare("is_legal({0}, {1}, {2})".format(owner, row, col), got,
+                          self.reference.is_legal(owner, row, col))
+        return got
+
+    def legal_moves(self, owner):
+        got = self.board.legal_moves(owner)
+        if self.sampled:
+            self._compare("legal_moves({0})".format(owner), sorted(got),
+                          sorted(self.reference.legal_moves(owner)))
+        return got
+
+    def place_move(self, owner, row, col):
+        got = self.board.place_move(owner, row, col)
+        expected = self.reference.place_move(owner, row, col)
+        if self.sampled:
+            call = "place_move({0}, {1}, {2})".format(owner, row, col)
+            self._compare(call, sorted(got), sorted(expected))
+            self._compare(call + " hash", self.board.hash, self.reference.hash)
+        return got
+
+    def push_state(self):
+        self.board.push_state()
+        self.reference.push_state()
+        self.moves += 1
+        self._sample()
+
+    def count_scores(self):
+        got = self.board.count_scores()
+        if self.sampled:
+            self._compare("count_scores()", got, self.reference.count_scores())
+        return got
+
+    def mark_ko(self, player):
+        self.board.mark_ko(player)
+        self.reference.mark_ko(player)
+
+    def unmark_ko(self):
+        self.board.unmark_ko()
+        self.reference.unmark_ko()
+
+    def to_csv(self):
+        got = self.board.to_csv()
+        if self.sampled:
+            self._compare("to_csv()", got, self.reference.to_csv())
+        return got
+
+    def text_board(self):
+        self.board.text_board()
+
+    def report(self):
+        return "cross check: {0} divergences in {1} sampled of {2} positions".format(
+            len(self.divergences), self.sampled_positions, self.moves + 1)
+
+# End of CrossCheck class
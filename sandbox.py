@@ -31,6 +31,17 @@ except ImportError:
 class SandboxError(Exception):
     pass
 
+def _notify(sandbox):
+    """Tell whoever is waiting on the sandbox that it has output
+
+    notify is a queue the engine may set on a sandbox; the monitor
+    threads put the sandbox on it after each line, so the engine can
+    block until some bot has something to read.
+    """
+    notify = sandbox.notify
+    if notify is not None:
+        notify.put(sandbox)
+
 def _guard_monitor(jail):
     guard_out = jail.command_process.stdout
     while True:
@@ -40,6 +51,7 @@ def _guard_monitor(jail):
             jail.resp_queue.put(end_item)
             jail.stdout_queue.put(end_item)
             jail.stderr_queue.put(end_item)
+            _notify(jail)
             break
         line = line.rstrip("\r\n")
         words = line.split(None, 2)
@@ -52,8 +64,10 @@ def _guard_monitor(jail):
         data = unicode(data, errors="replace")
         if msg == "STDOUT":
             jail.stdout_queue.put((time, data))
+            _notify(jail)
         elif msg == "STDERR":
             jail.stderr_queue.put((time, data))
+            _notify(jail)
         elif msg == "SIGNALED":
             jail.resp_queue.put((time, data))
 
@@ -98,6 +112,7 @@ class Jail(object):
 
         self._is_alive = False
         self.command_process = None
+        self.notify = None
         self.resp_queue = Queue()
         self.stdout_queue = Queue()
         self.stderr_queue = Queue()
@@ -325,15 +340,17 @@ class Jail(object):
             return True
 
 
-def _monitor_file(fd, q):
+def _monitor_file(fd, q, sandbox):
     while True:
         line = fd.readline()
         if not line:
             q.put(None)
+            _notify(sandbox)
             break
         line = unicode(line, errors="replace")
         line = line.rstrip('\r\n')
         q.put(line)
+        _notify(sandbox)
 
 class House:
     """Provide an insecure sandbox to run arbitrary commands in.
@@ -352,6 +369,7 @@ class House:
         """
         self._is_alive = False
         self.command_process = None
+        self.notify = None
         self.stdout_queue = Queue()
         self.stderr_queue = Queue()
         self.working_directory = working_directory
@@ -385,11 +403,11 @@ class House:
             raise SandboxError('Failed to start {0}'.format(shell_command))
         self._is_alive = True
         stdout_monitor = Thread(target=_monitor_file,
-                                args=(self.command_process.stdout, self.stdout_queue))
+                                args=(self.command_process.stdout, self.stdout_queue, self))
         stdout_monitor.daemon = True
         stdout_monitor.start()
         stderr_monitor = Thread(target=_monitor_file,
-                                args=(self.command_process.stderr, self.stderr_queue))
+                                args=(self.command_process.stderr, self.stderr_queue, self))
         stderr_monitor.daemon = True
         stderr_monitor.start()
         Thread(target=self._child_writer).start()
@@ -1,6 +1,10 @@
 import copy
+from array import array
+from itertools import chain
 
 EMPTY, FRIEND, ENEMY, LIBERTY, KO = [0, 1, 2, 3, -1]
+# Fills the frame around a FlatBoard
+BORDER = 4
 
 ADJACENT = [
     (-1, 0),
@@ -10,6 +14,29 @@ ADJACENT = [
 ]
 
 KO_BOARDS = 11 # How many previous board positions to store for ko prevention
+CHECKSUM_MODULUS = 2 ** 32 # field_delta checksums wrap at this value
+
+# field_packed gives each cell a 2-bit code (0 empty, 1 and 2 the players'
+# ids, 3 ko) and puts three cells in every base64 character, first cell
+# in the high bits
+PACKED_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+PACKED_VALUES = [0, 1, 2, -1]
+_PACKED_ENCODE = {}
+_PACKED_DECODE = {}
+for (_index, _char) in enumerate(PACKED_ALPHABET):
+    _cells = (PACKED_VALUES[_index >> 4], PACKED_VALUES[(_index >> 2) & 3], PACKED_VALUES[_index & 3])
+    _PACKED_ENCODE[_cells] = _char
+    _PACKED_DECODE[_char] = _cells
+
+def encode_field(values):
+    """ Pack the engine's cell values, row-major, three to a character """
+    cells = list(values) + [0, 0]
+    triples = iter(cells[:len(cells) - (len(cells) % 3)])
+    return ''.join(map(_PACKED_ENCODE.__getitem__, zip(triples, triples, triples)))
+
+def decode_field(data, count):
+    """ The first count engine cell values of a packed field """
+    return list(chain.from_iterable(map(_PACKED_DECODE.__getitem__, data)))[:count]
 
 class Board:
 
@@ -19,6 +46,7 @@ class Board:
         self.height = height
         self.cell = [[EMPTY for col in range (0, width)] for row in range(0, height)]
         self.prev_cells = [None for i in range (0, KO_BOARDS)]
+        self.undo_log = []
 
     def int_to_cell(self, i):
         if i == 0:
@@ -30,6 +58,17 @@ class Board:
         else:
             return ENEMY
 
+    def cell_to_int(self, cell):
+        """ The engine's value for a cell, the inverse of int_to_cell """
+        if cell == FRIEND:
+            return self.friend_id
+        elif cell == ENEMY:
+            return 3 - self.friend_id
+        elif cell == KO:
+            return -1
+        else:
+            return 0
+
     def parse(self, data):
         cells = data.split(',')
         col = 0
@@ -41,6 +80,29 @@ class Board:
             self.cell[row][col] = self.int_to_cell(int(cell))
             col += 1
 
+    def parse_packed(self, data):
+        """ Read a field_packed field """
+        lookup = dict((value, self.int_to_cell(value)) for value in PACKED_VALUES)
+        cells = [lookup[value] for value in decode_field(data, self.width * self.height)]
+        self.cell = [cells[row * self.width:(row + 1) * self.width] for row in range(0, self.height)]
+
+    def apply_delta(self, changes):
+        """ Update the cells listed in a field_delta, as col,row,value;... """
+        for change in changes.split(';'):
+            if change:
+                (col, row, value) = change.split(',')
+                self.cell[int(row)][int(col)] = self.int_to_cell(int(value))
+
+    def checksum(self):
+        """ The engine's field checksum for this position, to check deltas against """
+        total = 0
+        index = 1
+        for row in self.cell:
+            for cell in row:
+                total += index * (self.cell_to_int(cell) + 2)
+                index += 1
+        return total % CHECKSUM_MODULUS
+
     def valid_step(self, offset, target):
         ro, co = offset
         row, col = target
@@ -104,12 +166,34 @@ class Board:
         is_cap = False
         to_remove = []
         for (valid, (ar, ac)) in self.get_adjacent(row, col):
-            if valid and not self.cell[row][col] == self.cell[ar][ac] and not self.cell[ar][ac] == EMPTY:
+            # a ko mark is an empty point, a liberty rather than a chain to capture
+            if valid and self.cell[row][col] != self.cell[ar][ac] and self.cell[ar][ac] != EMPTY and self.cell[ar][ac] != KO \
+                    and (ar, ac) not in to_remove:
                 dfs.refresh()
                 dfs.flood_fill(ar, ac)
-                if EMPTY not in dfs.reached:
+                if EMPTY not in dfs.reached and KO not in dfs.reached:
                     to_remove = to_remove + dfs.matched
         self.remove_pieces(to_remove)
+        return to_remove
+
+    def play(self, owner, row, col):
+        """ place_move, remembering what undo() needs to take it back
+
+        Lets a search try moves in place instead of copying the board.
+        """
+        captured = self.place_move(owner, row, col)
+        self.undo_log.append((owner, row, col, captured))
+        return captured
+
+    def undo(self):
+        """ Take back the last play() """
+        (owner, row, col, captured) = self.undo_log.pop()
+        self.cell[row][col] = EMPTY
+        other = ENEMY
+        if owner == ENEMY:
+            other = FRIEND
+        for (r, c) in captured:
+            self.cell[r][c] = other
 
     def not_ko(self, row, col):
         return self.cell[row][col] != KO
@@ -167,19 +251,26 @@ class DepthFirstSearch:
         self.matched = []
 
     def search_step(self, fillval, loc):
-        row, col = loc
-        if not self.visited[row][col]:
-            self.visited[row][col] = True
-            if self.board.cell[row][col] == fillval:
-                self.matched.append((row, col))
-                adjacents = self.board.get_adjacent(row, col)
-                for (valid, target) in adjacents:
-                    if valid:
-                        self.search_step (fillval, target)
-            else:
-                reached = self.board.cell[row][col]
-                if reached not in self.reached:
-                    self.reached.append(reached)
+        """ Visit the points connected to loc through cells equal to fillval
+
+        Uses an explicit stack rather than recursion, so long or winding
+        chains on big boards can't hit the recursion limit.
+        """
+        stack = [loc]
+        while stack:
+            row, col = stack.pop()
+            if not self.visited[row][col]:
+                self.visited[row][col] = True
+                if self.board.cell[row][col] == fillval:
+                    self.matched.append((row, col))
+                    adjacents = self.board.get_adjacent(row, col)
+                    for (valid, target) in reversed(adjacents):
+                        if valid:
+                            stack.append(target)
+                else:
+                    reached = self.board.cell[row][col]
+                    if reached not in self.reached:
+                        self.reached.append(reached)
 
     def flood_fill(self, row, col):
         fillval = self.board.cell[row][col]
@@ -195,4 +286,283 @@ class DepthFirstSearch:
         self.visited = [[False for cell in row] for row in self.board.cell]
         self.reached = []
         self.matched = []
-        
+
+class FlatRow:
+    """ One row of a FlatBoard, indexed by column """
+
+    def __init__(self, data, start, width):
+        self.data = data
+        self.start = start
+        self.width = width
+
+    def __len__(self):
+        return self.width
+
+    def __iter__(self):
+        return iter(self.data[self.start:self.start + self.width])
+
+    def __getitem__(self, col):
+        if col < 0 or col >= self.width:
+            raise IndexError(col)
+        return self.data[self.start + col]
+
+    def __setitem__(self, col, value):
+        if col < 0 or col >= self.width:
+            raise IndexError(col)
+        self.data[self.start + col] = value
+
+
+class FlatRows:
+    """ A FlatBoard seen as board.cell[row][col] """
+
+    def __init__(self, board):
+        self.board = board
+
+    def __len__(self):
+        return self.board.height
+
+    def __iter__(self):
+        for row in range(0, self.board.height):
+            yield self[row]
+
+    def __getitem__(self, row):
+        board = self.board
+        if row < 0 or row >= board.height:
+            raise IndexError(row)
+        return FlatRow(board.data, (row + 1) * board.stride + 1, board.width)
+
+
+_ADJACENT = {}
+
+class FlatBoard(Board):
+    """ Board stored in one flat array('b') with a BORDER frame around it
+
+    A drop-in replacement for Board: cell is a row view onto the flat
+    buffer, get_adjacent returns lists precomputed once per board size,
+    and push_state stores a plain copy of the buffer.
+    """
+
+    def __init__(self, friend_id, width, height):
+        self.friend_id = friend_id
+        self.width = width
+        self.height = height
+        self.stride = width + 2
+        self.data = array('b', [BORDER] * (self.stride * (height + 2)))
+        for row in range(0, height):
+            start = (row + 1) * self.stride + 1
+            self.data[start:start + width] = array('b', [EMPTY] * width)
+        self.prev_cells = [None for i in range (0, KO_BOARDS)]
+        self.undo_log = []
+        key = (width, height)
+        if key not in _ADJACENT:
+            _ADJACENT[key] = dict((((row, col), [Board.valid_step(self, offset, (row, col)) for offset in ADJACENT])
+                for row in range(0, height) for col in range(0, width)))
+        self.adjacent = _ADJACENT[key]
+
+    @property
+    def cell(self):
+        return FlatRows(self)
+
+    def parse(self, data):
+        values = array('b', [self.int_to_cell(int(cell)) for cell in data.split(',')])
+        for row in range(0, self.height):
+            start = (row + 1) * self.stride + 1
+            self.data[start:start + self.width] = values[row * self.width:(row + 1) * self.width]
+
+    def parse_packed(self, data):
+        lookup = dict((value, self.int_to_cell(value)) for value in PACKED_VALUES)
+        values = array('b', [lookup[value] for value in decode_field(data, self.width * self.height)])
+        for row in range(0, self.height):
+            start = (row + 1) * self.stride + 1
+            self.data[start:start + self.width] = values[row * self.width:(row + 1) * self.width]
+
+    def get_adjacent(self, row, col):
+        return self.adjacent[(row, col)]
+
+    def cells_match(self, c2):
+        return c2 is not None and self.data == c2
+
+    def push_state(self):
+        self.prev_cells.pop()
+        self.prev_cells.insert(0, self.data[:])
+
+# End of FlatBoard class
+
+
+_BITS = {}
+
+class BitBoard(Board):
+    """ Board kept as Python ints with one bit per point
+
+    Bit row * stride + col is (row, col), with stride width + 1 so each
+    row ends in a guard bit and shifts can't wrap between rows. Chains
+    and liberties come from shift-and-mask dilation instead of a
+    DepthFirstSearch, and push_state stores the masks as a tuple. cell
+    is built from the masks on each access, so write through parse or
+    place_move rather than into cell.
+    """
+
+    def __init__(self, friend_id, width, height):
+        self.friend_id = friend_id
+        self.width = width
+        self.height = height
+        self.stride = width + 1
+        self.friend = 0
+        self.enemy = 0
+        self.ko = 0
+        self.prev_cells = [None for i in range (0, KO_BOARDS)]
+        self.undo_log = []
+        key = (width, height)
+        if key not in _BITS:
+            on_board = 0
+            for row in range(0, height):
+                on_board |= ((1 << width) - 1) << (row * self.stride)
+            _BITS[key] = on_board
+        self.on_board = _BITS[key]
+
+    @property
+    def cell(self):
+        rows = []
+        for row in range(0, self.height):
+            rows.append([self._cell_at(1 << (row * self.stride + col)) for col in range(0, self.width)])
+        return rows
+
+    def _cell_at(self, bit):
+        if self.friend & bit:
+            return FRIEND
+        elif self.enemy & bit:
+            return ENEMY
+        elif self.ko & bit:
+            return KO
+        return EMPTY
+
+    def _bit(self, row, col):
+        return 1 << (row * self.stride + col)
+
+    def _dilate(self, mask):
+        stride = self.stride
+        return (mask | (mask << 1) | (mask >> 1) | (mask << stride) | (mask >> stride)) & self.on_board
+
+    def _flood(self, seed, within):
+        reached = seed
+        while True:
+            grown = self._dilate(reached) & within
+            if grown == reached:
+                return reached
+            reached = grown
+
+    def _captures(self, mine, theirs, bit):
+        """ The stones of theirs left without liberties once mine plays bit """
+        free = self.on_board & ~(mine | theirs | bit)
+        captured = 0
+        around = self._dilate(bit) & theirs
+        while around:
+            chain = self._flood(around & -around, theirs)
+            if not self._dilate(chain) & free:
+                captured |= chain
+            around &= ~chain
+        return captured
+
+    def parse(self, data):
+        self._parse_values([int(cell) for cell in data.split(',')])
+
+    def _parse_values(self, values):
+        self.friend = 0
+        self.enemy = 0
+        self.ko = 0
+        for (i, cell) in enumerate(values):
+            bit = 1 << ((i // self.width) * self.stride + i % self.width)
+            value = self.int_to_cell(cell)
+            if value == FRIEND:
+                self.friend |= bit
+            elif value == ENEMY:
+                self.enemy |= bit
+            elif value == KO:
+                self.ko |= bit
+
+    def parse_packed(self, data):
+        self._parse_values(decode_field(data, self.width * self.height))
+
+    def apply_delta(self, changes):
+        for change in changes.split(';'):
+            if change:
+                (col, row, value) = change.split(',')
+                bit = self._bit(int(row), int(col))
+                self.friend &= ~bit
+                self.enemy &= ~bit
+                self.ko &= ~bit
+                cell = self.int_to_cell(int(value))
+                if cell == FRIEND:
+                    self.friend |= bit
+                elif cell == ENEMY:
+                    self.enemy |= bit
+                elif cell == KO:
+                    self.ko |= bit
+
+    def not_suicide(self, row, col):
+        bit = self._bit(row, col)
+        free = self.on_board & ~(self.friend | self.enemy | bit)
+        if self._dilate(self._flood(bit, self.friend | bit)) & free:
+            return True
+        return self.is_capture(row, col)
+
+    def is_capture(self, row, col):
+        return self._captures(self.friend, self.enemy, self._bit(row, col)) != 0
+
+    def cells_match(self, c2):
+        return c2 == (self.friend, self.enemy)
+
+    def place_move(self, owner, row, col):
+        bit = self._bit(row, col)
+        self.ko &= ~bit
+        if owner == FRIEND:
+            captured = self._captures(self.friend, self.enemy, bit)
+            self.friend |= bit
+            self.enemy &= ~captured
+        else:
+            captured = self._captures(self.enemy, self.friend, bit)
+            self.enemy |= bit
+            self.friend &= ~captured
+        to_remove = []
+        while captured:
+            low = captured & -captured
+            to_remove.append(divmod(low.bit_length() - 1, self.stride))
+            captured ^= low
+        return to_remove
+
+    def undo(self):
+        """ Take back the last play() """
+        (owner, row, col, captured) = self.undo_log.pop()
+        bit = self._bit(row, col)
+        restored = 0
+        for (r, c) in captured:
+            restored |= self._bit(r, c)
+        if owner == FRIEND:
+            self.friend &= ~bit
+            self.enemy |= restored
+        else:
+            self.enemy &= ~bit
+            self.friend |= restored
+
+    def legal_moves(self):
+        legal = []
+        free = self.on_board & ~(self.friend | self.enemy | self.ko)
+        while free:
+            low = free & -free
+            (row, col) = divmod(low.bit_length() - 1, self.stride)
+            if self.not_suicide(row, col):
+                legal.append((row, col))
+            free ^= low
+        return legal
+
+    def not_fill_own_eye(self, mv):
+        """ This assumes that (mv) is an empty tile """
+        (row, col) = mv
+        bit = self._bit(row, col)
+        return (self._dilate(bit) & ~bit & ~self.friend) != 0
+
+    def push_state(self):
+        self.prev_cells.pop()
+        self.prev_cells.insert(0, (self.friend, self.enemy))
+
+# End of BitBoard class
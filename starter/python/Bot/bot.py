@@ -9,6 +9,10 @@ class Bot:
     def setup(self, game):
         self.game = game
 
+    def new_game(self):
+        # anything expensive loaded in __init__ can be kept for the next game
+        self.game = None
+
     def do_turn(self):
         legal = self.game.field.legal_moves()
         desirable = list(filter(self.game.field.not_fill_own_eye, legal))
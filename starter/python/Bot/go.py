@@ -20,6 +20,19 @@ class Go():
         self.field_height = 0
 
         self.field = None
+        # board.FlatBoard and board.BitBoard are drop-in replacements storing
+        # the field in a flat array or as bitmasks
+        self.board_class = board.Board
+        # set to True to ask the engine to send only the changed cells of
+        # the field each turn, for engines that support field_updates delta
+        self.field_deltas = False
+        self.deltas_requested = False
+        # True from a delta that fails its checksum until a whole field comes
+        self.field_stale = False
+        # set to True to ask for whole fields in the packed encoding rather
+        # than CSV, for engines that support field_encoding packed
+        self.packed_fields = False
+        self.packing_requested = False
         self.round = 0
         self.turn = 0
         self.my_points = 0
@@ -36,7 +49,9 @@ class Go():
         # start timer
         self.last_update = time.time()
         for line in data.split('\n'):
-            line = line.strip().lower()
+            # packed fields are case sensitive, so keep the line as sent too
+            raw = line.strip()
+            line = raw.lower()
             if len(line) > 0:
                 tokens = line.split()
                 key0 = tokens[0]
@@ -68,9 +83,23 @@ class Go():
                             self.move = int(tokens[3])
                         elif key2 == "field":
                             if self.field == None:
-                                self.field = board.Board(self.your_botid, self.field_width, self.field_height)
+                                self.field = self.board_class(self.your_botid, self.field_width, self.field_height)
                             self.field.parse(tokens[3])
                             self.field.push_state()
+                            self.field_stale = False
+                        elif key2 == "field_packed":
+                            if self.field == None:
+                                self.field = self.board_class(self.your_botid, self.field_width, self.field_height)
+                            self.field.parse_packed(raw.split()[3])
+                            self.field.push_state()
+                            self.field_stale = False
+                        elif key2 == "field_delta":
+                            self.field.apply_delta(tokens[4] if len(tokens) > 4 else "")
+                            if self.field.checksum() != int(tokens[3]):
+                                # out of step: asking again makes the engine send the whole field
+                                self.deltas_requested = False
+                                self.field_stale = True
+                            self.field.push_state()
 
                     elif key1 in self.player_names:
                         key2 = tokens[2]
@@ -126,8 +155,29 @@ class Go():
                     self.update(data)
                     if (bot.game == None):
                         bot.setup(self)
-                    bot.do_turn()
+                    if self.field_deltas and not self.deltas_requested:
+                        sys.stdout.write('settings field_updates delta\n')
+                        self.deltas_requested = True
+                    if self.packed_fields and not self.packing_requested:
+                        sys.stdout.write('settings field_encoding packed\n')
+                        self.packing_requested = True
+                    if self.field_stale:
+                        # no move is safe on a field we know is wrong
+                        self.issue_order_pass()
+                    else:
+                        bot.do_turn()
+                    data = ''
+                elif current_line.lower().startswith("new game"):
+                    # the engine is keeping this process for another game,
+                    # which starts with its settings as usual; the bot's
+                    # own choices of board and protocol carry over
+                    choices = (self.board_class, self.field_deltas, self.packed_fields)
+                    self.__init__()
+                    (self.board_class, self.field_deltas, self.packed_fields) = choices
+                    bot.new_game()
                     data = ''
+                    sys.stdout.write('ready\n')
+                    sys.stdout.flush()
                 elif current_line.lower().startswith("quit"):
                     not_finished = False
             except EOFError:
@@ -1,2 +1,3 @@
 #!/bin/bash
+python test_board.py
 cat sample.txt | python main.py
@@ -0,0 +1,45 @@
+# python3
+# Checks of the starter boards, run by test.sh or with pytest
+
+from Bot.board import Board, FlatBoard, BitBoard, FRIEND
+
+BOARDS = [Board, FlatBoard, BitBoard]
+
+# player 1's view of a 5x5 field: the corner point is empty with enemy
+# stones on both sides, and playing it captures the one at (0, 1); the
+# point at (4, 4) is surrounded by enemy stones that have liberties
+SURROUNDED = ("0,2,1,0,0,"
+              "2,1,0,0,0,"
+              "1,0,0,0,0,"
+              "0,0,0,0,2,"
+              "0,0,0,2,0")
+
+def test_legal_moves_surrounded_point():
+    for board_class in BOARDS:
+        board = board_class(1, 5, 5)
+        board.parse(SURROUNDED)
+        legal = board.legal_moves()
+        assert (0, 0) in legal, board_class.__name__
+        assert (4, 4) not in legal, board_class.__name__
+        assert board.is_capture(0, 0), board_class.__name__
+
+# a ko mark at (4, 3) with stones all round it but for (4, 4)
+NEXT_TO_KO = ("0,0,0,0,0,"
+              "0,0,0,0,0,"
+              "0,0,0,0,0,"
+              "0,0,0,2,2,"
+              "0,0,2,-1,0")
+
+def test_play_and_undo_next_to_ko():
+    for board_class in BOARDS:
+        board = board_class(1, 5, 5)
+        board.parse(NEXT_TO_KO)
+        before = [list(row) for row in board.cell]
+        assert board.play(FRIEND, 4, 4) == [], board_class.__name__
+        board.undo()
+        assert [list(row) for row in board.cell] == before, board_class.__name__
+
+if __name__ == '__main__':
+    test_legal_moves_surrounded_point()
+    test_play_and_undo_next_to_ko()
+    print("ok")
@@ -206,6 +206,14 @@ Replay.prototype.parseReplay = function(replay) {
 
 	// map
     this.rows = this.cols = 19; // Go game defaults
+    if (replay['rows'] !== undefined) {
+        keyRange(replay, 'rows', 1, 49);
+        this.rows = replay['rows'];
+    }
+    if (replay['cols'] !== undefined) {
+        keyRange(replay, 'cols', 1, 49);
+        this.cols = replay['cols'];
+    }
     if (replay['map']) {
         var map = enterObj(replay, 'map');
         keyIsArr(map, 'data', 1, undefined);
@@ -6,6 +6,15 @@ import os
 import webbrowser
 import json
 
+try:
+    from replay import to_legacy, read_stream
+    from archive import ReplayArchive, FILE_HEADER
+except ImportError:
+    # launched from the visualizer directory, so add the engine's to the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from replay import to_legacy, read_stream
+    from archive import ReplayArchive, FILE_HEADER
+
 def generate(data, generated_path):
     path = os.path.dirname(__file__)
     template_path = os.path.join(path, 'replay.html.template')
@@ -30,7 +39,11 @@ def generate(data, generated_path):
         # but leaves them inside values.
         # before: [["update game round", 1], ["update game move", 3]]
         # after: [["update game round",1],["update game move",3]]
-        data = json.dumps(json.loads(data), separators=(',', ':'))
+        replay = json.loads(data)
+        # the visualizer reads revision 1, so expand revision 2 replays
+        if 'replaydata' in replay:
+            replay['replaydata'] = to_legacy(replay['replaydata'])
+        data = json.dumps(replay, separators=(',', ':'))
     except ValueError:
         data = data.replace('\n', '\\\\n')
 
@@ -41,13 +54,32 @@ def generate(data, generated_path):
     output.write(content)
     output.close()
 
-def launch(filename=None, nolaunch=False, generated_path=None):
+def is_archive(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(FILE_HEADER)) == FILE_HEADER
+
+def launch(filename=None, nolaunch=False, generated_path=None, game_id=None, offset=None):
     if generated_path == None:
         generated_path = 'replay.html'
     if filename == None:
         data = sys.stdin.read()
         generated_path = os.path.realpath(os.path.join(os.path.dirname(__file__)
                                                        , generated_path))
+    elif filename.endswith('.jsonl'):
+        # a streamed replay, see replay.ReplayWriter
+        with open(filename, 'r') as f:
+            data = json.dumps(read_stream(f))
+        generated_path = os.path.join(os.path.split(filename)[0], generated_path)
+    elif is_archive(filename):
+        # extract one game from a replay archive, see archive.ReplayArchive
+        archive = ReplayArchive(filename)
+        try:
+            if game_id is None and offset is None:
+                offset = archive.offsets()[-1]
+            data = json.dumps(archive.game(game_id, offset))
+        finally:
+            archive.close()
+        generated_path = os.path.join(os.path.split(filename)[0], generated_path)
     else:
         with open(filename, 'r') as f:
             data = f.read()
@@ -60,4 +92,15 @@ def launch(filename=None, nolaunch=False, generated_path=None):
         webbrowser.open('file://'+os.path.realpath(generated_path))    
 
 if __name__ == "__main__":
-    launch(nolaunch=len(sys.argv) > 1 and sys.argv[1] == '--nolaunch')
+    # visualize_locally.py [--nolaunch] [replay file or archive [game id [offset]]]
+    # the offset picks one of the games appended under the same id
+    args = sys.argv[1:]
+    nolaunch = '--nolaunch' in args
+    args = [arg for arg in args if arg != '--nolaunch']
+    filename = args[0] if args else None
+    game_id = None
+    if len(args) > 1:
+        # playgame numbers its games, other archives may use names
+        game_id = int(args[1]) if args[1].isdigit() else args[1]
+    offset = int(args[2]) if len(args) > 2 else None
+    launch(filename, nolaunch=nolaunch, game_id=game_id, offset=offset)